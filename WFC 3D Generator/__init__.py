@@ -1,11 +1,15 @@
 # Written 2025 by Dan Rohde
 
-import bpy
+try:
+    import bpy
+except ImportError:
+    # outside of Blender only the solver core (solver, constraints, grid, ...) is available
+    bpy = None
 
-from . import properties, edit_operators, edit_panel, gen_operators, gen_panel, handler
+if bpy is not None:
+    from . import properties, edit_operators, edit_panel, gen_operators, gen_panel, handler
 
-
-classes = properties.properties + edit_operators.operators + edit_panel.panels + gen_operators.operators + gen_panel.panels
+    classes = properties.properties + edit_operators.operators + edit_panel.panels + gen_operators.operators + gen_panel.panels
 
 def register():
     for cls in classes:
@@ -23,4 +27,4 @@ def unregister():
     bpy.app.handlers.depsgraph_update_post.remove(handler.update_handler)
 
 if __name__ == "__main__":
-    register()
\ No newline at end of file
+    register()
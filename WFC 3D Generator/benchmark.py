@@ -0,0 +1,185 @@
+"""Benchmark of the solver core with synthetic rulesets (runs without Blender).
+
+    python benchmark.py [--suite quick|default|full] [--output results.json] [--baseline baseline.json]
+
+Each scenario is solved --repeat times with a cold ruleset cache, the fastest run of each
+phase is reported: load (compile the ruleset), initialize_grid, observe (choose and collapse
+cells), propagate, backtrack, place (placement records of the solved tiles, the Blender
+objects themselves are not created) and total. With --baseline, phases that got slower than
+--threshold are reported as regressions (exit code 1).
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+import time
+import numpy as np
+
+PACKAGE = "wfc_3d_generator"
+PHASES = [ 'load', 'initialize_grid', 'observe', 'propagate', 'backtrack', 'place', 'total' ]
+MIXES = [ 'plain', 'frequency', 'symmetry', 'grid', 'mixed' ]
+# phases faster than this (seconds) are never reported as regressions
+NOISE_FLOOR = 0.005
+
+def _core(module):
+    """Imports a module of the add-on (as a script the add-on directory is loaded as package)"""
+    if __package__:
+        return importlib.import_module(f"{__package__}.{module}")
+    if PACKAGE not in sys.modules:
+        path = os.path.dirname(os.path.abspath(__file__))
+        spec = importlib.util.spec_from_file_location(PACKAGE, os.path.join(path, "__init__.py"), submodule_search_locations=[path])
+        sys.modules[PACKAGE] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(sys.modules[PACKAGE])
+    return importlib.import_module(f"{PACKAGE}.{module}")
+
+def synthetic_ruleset(n_tiles, density=0.6, mix='plain', grid_size=(10, 10, 10), seed=0):
+    """Returns a random solvable ruleset: in each face direction a tile permits itself and each
+    other tile with the probability density (both tiles permit each other, other directions allow
+    all tiles). mix adds frequency, symmetry, grid/region constraints or all of them to some tiles"""
+    constants = _core("constants")
+    rnd = random.Random(seed)
+    names = [ f"tile_{i}" for i in range(n_tiles) ]
+    ruleset = { name: { d: [ name ] for d in constants.FACE_DIRECTIONS } for name in names }
+    for d in [ 'TOP', 'FRONT', 'LEFT' ]:
+        opposite = constants.OPPOSITE_DIRECTIONS[d]
+        for a in names:
+            for b in names:
+                if a != b and rnd.random() < density:
+                    ruleset[a][d].append(b)
+                    ruleset[b][opposite].append(a)
+    cells = int(np.prod(grid_size))
+    tiles = list(ruleset.values())
+    if mix in ('frequency', 'mixed'):
+        for i, constraints in enumerate([ { 'freq_grid': max(1, cells // (2 * n_tiles)) }, { 'freq_neighbor_face': 2 },
+                                          { 'freq_axes': (max(1, grid_size[0] // 4), -1, -1) }, { 'freq_any_neighbor_face': 4 },
+                                          { 'weight': 3.0 }, { 'probability': 0.2 } ]):
+            if i < n_tiles:
+                tiles[i].update(constraints)
+    if mix in ('symmetry', 'mixed'):
+        for i, constraints in enumerate([ { 'sym_mirror_axes': (True, False, False) },
+                                          { 'sym_rotate_axis': (0.0, 0.0, 1.0), 'sym_rotate_n': 4 } ]):
+            if i < n_tiles:
+                tiles[-1 - i].update(constraints)
+    if mix in ('grid', 'mixed'):
+        for i, constraints in enumerate([ { 'corners': ['-'], 'edges': ['-'] }, { 'faces': ['top', 'bottom'], 'inside': ['False'] },
+                                          { 'region_min': (0, 0, 0), 'region_max': (-1, -1, grid_size[2] // 2) } ]):
+            if i < n_tiles:
+                tiles[i].update(constraints)
+    return ruleset
+
+def scenario(size, tiles=8, density=0.6, mix='plain', **options):
+    name = f"{mix}-t{tiles}-d{density}-{size}" + "".join(f"-{k}={v}" for k, v in sorted(options.items()))
+    return { 'name': name, 'size': size, 'tiles': tiles, 'density': density, 'mix': mix, 'options': options }
+
+def suite(name):
+    """Returns the scenarios of a suite (quick: 10^3, default: up to 30^3, full: up to 100^3)"""
+    sizes = { 'quick': [10], 'default': [10, 20, 30], 'full': [10, 20, 30, 50, 100] }[name]
+    scenarios = [ scenario(size, mix=mix) for size in sizes for mix in MIXES ]
+    size = sizes[min(1, len(sizes) - 1)]
+    scenarios += [ scenario(size, tiles=tiles) for tiles in (4, 32, 128) ]
+    scenarios += [ scenario(size, density=density) for density in (0.3, 0.9) ]
+    scenarios += [ scenario(size, mix='mixed', entropy_mode='SHANNON'), scenario(size, mix='mixed', use_backtracking=True),
+                   scenario(size, propagation_mode='BATCH') ]
+    if name == 'full':
+        scenarios += [ scenario(100, mix='mixed', use_chunks=True, chunk_size=(32, 32, 32)) ]
+    return scenarios
+
+class _PhaseTimer:
+    def __init__(self):
+        self.times = dict.fromkeys(PHASES, 0.0)
+
+    def wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.times[phase] += time.perf_counter() - start
+        return timed
+
+def _place(solver, spacing=(2.0, 2.0, 2.0)):
+    """Placement records (tile name, location) as built by WFC3DGenerator.place_objects"""
+    records = []
+    for origin, tiles in solver.results():
+        for (x, y, z), tile in zip((np.argwhere(tiles >= 0) + origin).tolist(), tiles[tiles >= 0].tolist()):
+            records.append((solver.tiles[tile], (x * spacing[0], y * spacing[1], z * spacing[2])))
+    return records
+
+def run_scenario(s, seed=0):
+    """Solves a scenario once and returns the phase times and result statistics"""
+    solver_module, cache = _core("solver"), _core("cache")
+    grid_size = (s['size'],) * 3
+    ruleset = synthetic_ruleset(s['tiles'], s['density'], s['mix'], grid_size, seed)
+    cache.invalidate()
+    timer = _PhaseTimer()
+    start = time.perf_counter()
+    solver = solver_module.WFC3DSolver(ruleset, grid_size, seed, **s['options'])
+    timer.times['load'] = time.perf_counter() - start
+    solver.get_lowest_entropy_cell = timer.wrap('observe', solver.get_lowest_entropy_cell)
+    solver.collapse = timer.wrap('observe', solver.collapse)
+    solver.backtrack = timer.wrap('backtrack', solver.backtrack)
+    solver.constraints.initialize_grid = timer.wrap('initialize_grid', solver.constraints.initialize_grid)
+    solver.constraints.propagate = timer.wrap('propagate', solver.constraints.propagate)
+    stats = solver.run()
+    records = timer.wrap('place', _place)(solver)
+    timer.times['total'] = time.perf_counter() - start
+    cells = int(np.prod(grid_size))
+    counters = { k: v for k, v in stats.as_dict().items() if not k.endswith('_time') }
+    return { 'times': timer.times, 'cells': cells, 'empty': cells - len(records), 'stats': counters }
+
+def run_suite(scenarios, repeat=1, log=print):
+    results = []
+    for s in scenarios:
+        runs = [ run_scenario(s) for _ in range(repeat) ]
+        result = { **s, **runs[0], 'times': { p: min(r['times'][p] for r in runs) for p in PHASES } }
+        results.append(result)
+        log(f"{s['name']:<48} " + " ".join(f"{p}={result['times'][p]:.3f}" for p in PHASES if result['times'][p] > 0))
+    return results
+
+def compare(results, baseline, threshold=0.1, log=print):
+    """Compares phase times with a baseline, returns the regressions (name, phase, old, new)"""
+    old = { r['name']: r['times'] for r in baseline['results'] }
+    regressions = []
+    for r in results:
+        if r['name'] not in old:
+            continue
+        for p in PHASES:
+            a, b = old[r['name']].get(p, 0.0), r['times'][p]
+            if b > a * (1 + threshold) and b - a > NOISE_FLOOR:
+                regressions.append((r['name'], p, a, b))
+        a, b = old[r['name']]['total'], r['times']['total']
+        log(f"{r['name']:<48} total {a:.3f} -> {b:.3f} ({(b / a - 1) * 100 if a else 0:+.1f}%)")
+    for name, p, a, b in regressions:
+        log(f"REGRESSION {name} {p}: {a:.4f}s -> {b:.4f}s")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the WFC 3D solver core")
+    parser.add_argument("--suite", choices=['quick', 'default', 'full'], default='default')
+    parser.add_argument("--filter", default="", help="only scenarios whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="", help="JSON file for the results")
+    parser.add_argument("--baseline", default="", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as regression")
+    args = parser.parse_args(argv)
+
+    scenarios = [ s for s in suite(args.suite) if args.filter in s['name'] ]
+    results = run_suite(scenarios, args.repeat)
+    report = { 'meta': { 'suite': args.suite, 'repeat': args.repeat, 'python': platform.python_version(), 'numpy': np.__version__,
+                         'platform': platform.platform(), 'time': time.strftime("%Y-%m-%dT%H:%M:%S") },
+               'results': results }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f), args.threshold):
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
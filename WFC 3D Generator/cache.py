@@ -0,0 +1,31 @@
+from collections import OrderedDict
+
+# compiled rulesets of the last tile sets: fingerprint => entry
+MAX_ENTRIES = 4
+_entries = OrderedDict()
+
+def _value(v):
+    if isinstance(v, dict):
+        return tuple(sorted((k, _value(x)) for k, x in v.items()))
+    return tuple(_value(x) for x in v) if hasattr(v, '__len__') and not isinstance(v, str) else v
+
+def fingerprint(ruleset):
+    """Cheap fingerprint of a ruleset: tile names and a hash of their constraints"""
+    return (tuple(ruleset), hash(_value(ruleset)))
+
+def lookup(key):
+    """Returns the cached entry (a dict) of a fingerprint or None"""
+    entry = _entries.get(key)
+    if entry is not None:
+        _entries.move_to_end(key)
+    return entry
+
+def store(key, entry):
+    _entries[key] = entry
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+    return entry
+
+def invalidate():
+    """Drops all compiled rulesets (called by the edit operators)"""
+    _entries.clear()
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import numpy as np
+from itertools import product
+
+# tile id of cells whose chunk has not been solved yet
+UNSOLVED = -2
+# tile id of empty cells in stream files
+EMPTY_ID = 0xFFFF
+
+class WFC3DChunkStore:
+    """Tile ids of a world grid solved chunk by chunk.
+
+    Each solved chunk is kept as a compact integer array (-1 for empty cells), so a world
+    only needs a few bytes per cell while the solver works on one chunk at a time.
+    """
+    def __init__(self, world_size, chunk_size, n_tiles):
+        self.world_size = tuple(world_size)
+        self.chunk_size = tuple(min(c, w) for c, w in zip(chunk_size, world_size))
+        self.dtype = np.int16 if n_tiles < np.iinfo(np.int16).max else np.int32
+        self.chunks = {}
+        self.tile_counts = np.zeros(n_tiles, dtype=np.int64)
+
+    def keys(self):
+        """Returns the chunk keys in solving order"""
+        return list(product(*(range(-(-w // c)) for w, c in zip(self.world_size, self.chunk_size))))
+
+    def box(self, key):
+        """Returns origin and shape of a chunk"""
+        origin = tuple(k * c for k, c in zip(key, self.chunk_size))
+        shape = tuple(min(c, w - o) for c, w, o in zip(self.chunk_size, self.world_size, origin))
+        return origin, shape
+
+    def store(self, key, tiles):
+        tiles = np.asarray(tiles).astype(self.dtype)
+        tiles.flags.writeable = False
+        self.chunks[key] = tiles
+        self.tile_counts += np.bincount(tiles[tiles >= 0], minlength=len(self.tile_counts))
+
+    def get(self, origin, shape):
+        """Returns the tile ids of a box of the world (UNSOLVED for cells of unsolved chunks)"""
+        tiles = np.full(shape, UNSOLVED, dtype=self.dtype)
+        first = [ o // c for o, c in zip(origin, self.chunk_size) ]
+        last = [ (o + s - 1) // c for o, s, c in zip(origin, shape, self.chunk_size) ]
+        for key in product(*(range(f, l+1) for f, l in zip(first, last))):
+            if key not in self.chunks:
+                continue
+            chunk_origin, chunk_shape = self.box(key)
+            lo = [ max(o, co) for o, co in zip(origin, chunk_origin) ]
+            hi = [ min(o + s, co + cs) for o, s, co, cs in zip(origin, shape, chunk_origin, chunk_shape) ]
+            tiles[tuple(slice(l - o, h - o) for l, h, o in zip(lo, hi, origin))] = \
+                self.chunk(key)[tuple(slice(l - co, h - co) for l, h, co in zip(lo, hi, chunk_origin))]
+        return tiles
+
+    def chunk(self, key):
+        """Returns the tile ids of a solved chunk"""
+        return self.chunks[key]
+
+    def items(self):
+        """Yields (origin, tile ids) of all solved chunks"""
+        for key in self.chunks:
+            yield self.box(key)[0], self.chunk(key)
+
+    def line_offsets(self):
+        """Returns (axis, per line tile counts) the solver of the next chunk cannot see or None"""
+        return None
+
+
+class WFC3DStreamStore(WFC3DChunkStore):
+    """Tile ids of a world grid solved window by window along one axis.
+
+    A window spans the whole grid except along the streamed axis. Solved windows are written
+    to a uint16 numpy.memmap file (EMPTY_ID for empty cells), so the memory use does not depend
+    on the length of the streamed axis. Per line tile counts along the axis (last column: all
+    non-empty cells) summarise the solved slices for the axis frequency constraints.
+    """
+    def __init__(self, world_size, axis, window, n_tiles, filename=""):
+        if n_tiles >= EMPTY_ID:
+            raise ValueError(f"Streaming supports at most {EMPTY_ID} objects")
+        chunk_size = list(world_size)
+        chunk_size[axis] = window
+        super().__init__(world_size, chunk_size, n_tiles)
+        self.axis = axis
+        # a temporary file is removed by close
+        self.temporary = not filename
+        if not filename:
+            fd, filename = tempfile.mkstemp(suffix=".wfc")
+            os.close(fd)
+        self.filename = filename
+        self.volume = np.memmap(filename, dtype=np.uint16, mode='w+', shape=self.world_size)
+        cross_section = [ w for a, w in enumerate(self.world_size) if a != axis ]
+        self.line_counts = np.zeros((*cross_section, n_tiles + 1), dtype=np.int32)
+        self.last_slice_counts = np.zeros_like(self.line_counts)
+
+    def _slice_counts(self, tiles):
+        """Per line counts of tile ids along the streamed axis"""
+        counts = np.zeros_like(self.line_counts)
+        for tile in np.unique(tiles[tiles >= 0]).tolist():
+            counts[..., tile] = (tiles == tile).sum(axis=self.axis)
+        counts[..., -1] = (tiles >= 0).sum(axis=self.axis)
+        return counts
+
+    def store(self, key, tiles):
+        tiles = np.asarray(tiles)
+        origin, shape = self.box(key)
+        self.volume[tuple(slice(o, o + s) for o, s in zip(origin, shape))] = np.where(tiles >= 0, tiles, EMPTY_ID)
+        self.chunks[key] = None
+        self.tile_counts += np.bincount(tiles[tiles >= 0], minlength=len(self.tile_counts))
+        self.line_counts += self._slice_counts(tiles)
+        self.last_slice_counts = self._slice_counts(np.take(tiles, [tiles.shape[self.axis] - 1], axis=self.axis))
+
+    def chunk(self, key):
+        origin, shape = self.box(key)
+        tiles = np.asarray(self.volume[tuple(slice(o, o + s) for o, s in zip(origin, shape))]).astype(np.int32)
+        tiles[tiles == EMPTY_ID] = -1
+        return tiles
+
+    def line_offsets(self):
+        # the last solved slice is part of the halo of the next window
+        return [ (self.axis, self.line_counts - self.last_slice_counts) ]
+
+    def flush(self):
+        self.volume.flush()
+
+    def close(self):
+        """Releases the memmap and removes the file if it is a temporary file"""
+        self.volume = None
+        if self.temporary and os.path.exists(self.filename):
+            os.remove(self.filename)
+        self.temporary = False
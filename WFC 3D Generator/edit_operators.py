@@ -2,6 +2,7 @@ import bpy
 
 from .constants import *
 from .properties import update_constraint_properties, handle_update_collection, handle_edit_neighbor_constraint_update
+from . import cache
 
 def _get_obj(collection, name):
     if name in collection.objects:
@@ -16,6 +17,7 @@ def _get_obj_list(props):
     return ",".join(_get_selected_items(props.obj_list))
 
 def _update_constraints(props, constraints):
+    cache.invalidate()
     for item in _get_selected_items(props.obj_list):
         obj = _get_obj(props.collection_obj, item)
         for c in constraints:
@@ -27,6 +29,7 @@ def _update_constraints(props, constraints):
                         del obj["wfc_"+c]
 
 def _reset_constraints(props, constraints):
+    cache.invalidate()
     for item in _get_selected_items(props.obj_list):
         obj = _get_obj(props.collection_obj, item)
         for c in constraints:
@@ -40,6 +43,7 @@ class COLLECTION_OT_WFC3DUpdate_Neighbor_Constraint(bpy.types.Operator):
     bl_label = "Save Neighbor(s)"
     bl_options = {'REGISTER', 'UNDO'}
     def _set_neighbors(self, obj, prop_name, neighbors):
+        cache.invalidate()
         obj[prop_name] = neighbors
         self.report({'INFO'}, f"Neighbor(s) {neighbors} has/have been added to {prop_name} of object {obj.name}")
     def execute(self, context):
@@ -61,6 +65,7 @@ class COLLECTION_OT_WFC3DReset_Neighbor_Constraint(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'}
     def _reset_neighbor(self, obj, prop_name):
         if prop_name and prop_name in obj:
+            cache.invalidate()
             obj[prop_name]=''
             self.report({'INFO'}, f"{prop_name} have been reset for object: {obj.name}")
 
@@ -88,6 +93,7 @@ class COLLECTION_OT_WFC3DUpdate_Grid_Constraints(bpy.types.Operator):
         return ",".join(newval)
     
     def _set_grid_constraints(self, obj, props):
+        cache.invalidate()
         obj["wfc_corners"]= self._get_new_prop_val(props, "corner",['fbl','fbr','ftl','ftr','bbl','bbr','btl','btr'])
         obj["wfc_edges"] = self._get_new_prop_val(props, "edge",['fb','fl','fr','ft','bb','bl','br','bt','lb','lt','rb','rt'])
         obj["wfc_faces"] = self._get_new_prop_val(props, "face",['front','back','top','bottom','left','right'])
@@ -0,0 +1,56 @@
+import heapq
+import numpy as np
+
+from .rng import TIE_BREAK
+
+class WFC3DEntropyIndex:
+    """Priority queue of the uncollapsed cells ordered by entropy.
+
+    The queue is a heap with lazy invalidation: every domain change pushes a new entry
+    and outdated entries are skipped when they reach the top of the heap.
+    Ties are broken by grid order (x, y, z) or, with a WFC3DRandom, by a random key per cell
+    drawn for its world index.
+    """
+    def __init__(self, grid, get_entropy, entropies, random=None):
+        self.grid = grid
+        self.get_entropy = get_entropy
+        self.entropy = np.array(entropies, dtype=float)
+        self.ties = None
+        if random is not None:
+            cells = np.arange(self.entropy.size)
+            self.ties = random.randoms(TIE_BREAK, grid.world_index(*grid.coords(cells))).tolist()
+        self.heap = []
+        self._rebuild()
+
+    def _tie_break(self, idx):
+        return idx if self.ties is None else self.ties[idx]
+
+    def _rebuild(self):
+        open_cells = np.flatnonzero(~self.grid.collapsed)
+        entropy = self.entropy.ravel()
+        self.heap = [ (entropy[idx], self._tie_break(idx), idx) for idx in open_cells.tolist() ]
+        heapq.heapify(self.heap)
+
+    def update(self, idx):
+        """Re-queues a cell after its domain has changed"""
+        x, y, z = self.grid.coords(idx)
+        if self.grid.collapsed[x, y, z]:
+            return
+        entropy = self.get_entropy(x, y, z)
+        self.entropy[x, y, z] = entropy
+        heapq.heappush(self.heap, (entropy, self._tie_break(idx), idx))
+
+    def pop_lowest(self):
+        """Returns the uncollapsed cell with the lowest entropy or None if all cells are collapsed"""
+        for idx in self.grid.pop_changed():
+            self.update(idx)
+        if len(self.heap) > 4 * self.entropy.size:
+            self._rebuild()
+
+        while self.heap:
+            entropy, _, idx = heapq.heappop(self.heap)
+            x, y, z = self.grid.coords(idx)
+            if self.grid.collapsed[x, y, z] or entropy != self.entropy[x, y, z]:
+                continue
+            return (x, y, z)
+        return None
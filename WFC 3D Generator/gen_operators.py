@@ -1,13 +1,31 @@
 import bpy
+import time
+import numpy as np
 
 from .generator import WFC3DGenerator
+from . import stats
+
+# interval of the timer events and time spent per event of the interactive generation (seconds)
+TIMER_INTERVAL = 0.05
+TIME_BUDGET = 0.1
 
 class OBJECT_OT_WFC3DGenerate(bpy.types.Operator):
-    """Generates a 3D model with Wave Function Collapse"""
+    """Generates a 3D model with Wave Function Collapse (press Esc to cancel)"""
     bl_idname = "object.wfc_3d_generate"
     bl_label = "Generate WFC 3D Model"
     bl_options = {'REGISTER', 'UNDO'}
 
+    _generator = None
+    _steps = None
+    _timer = None
+    _phase = None
+    _start = 0.0
+    message = "WFC model successfully generated!"
+
+    def steps(self, context, generator):
+        """Returns the steps of the interactive generation"""
+        return generator.steps()
+
     def execute_prod(self, context):
         props = context.scene.wfc_props
         
@@ -17,7 +35,7 @@ class OBJECT_OT_WFC3DGenerate(bpy.types.Operator):
                 raise ValueError(f"Source collection '{props.collection_obj}' not found!")
                 
             generator = WFC3DGenerator(collection, props)
-            generator.generate_model()
+            stats.last = generator.generate_model()
             
             self.report({'INFO'}, "WFC model successfully generated!")
             return {'FINISHED'}
@@ -34,9 +52,108 @@ class OBJECT_OT_WFC3DGenerate(bpy.types.Operator):
             raise ValueError(f"Source collection '{props.collection_obj}' not found!")
             
         generator = WFC3DGenerator(collection, props)
-        generator.generate_model()
+        stats.last = generator.generate_model()
         
         self.report({'INFO'}, "WFC model successfully generated!")
         return {'FINISHED'}
-            
-operators = [ OBJECT_OT_WFC3DGenerate ]
\ No newline at end of file
+
+    def invoke(self, context, event):
+        """Generates in time slices from timer events, so Blender stays responsive"""
+        props = context.scene.wfc_props
+        collection = props.collection_obj
+        if not collection:
+            self.report({'ERROR'}, f"Source collection '{props.collection_obj}' not found!")
+            return {'CANCELLED'}
+
+        try:
+            self._generator = WFC3DGenerator(collection, props)
+            self._steps = self.steps(context, self._generator)
+        except ValueError as e:
+            self.report({'ERROR'}, f"Error: {str(e)}")
+            return {'CANCELLED'}
+        self._phase = 'SOLVE'
+        self._start = time.perf_counter()
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(TIMER_INTERVAL, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self._finish(context)
+            self.report({'WARNING'}, f"WFC generation cancelled ({self._generator.placed} objects placed)")
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        deadline = time.perf_counter() + TIME_BUDGET
+        try:
+            for _ in self._steps:
+                if time.perf_counter() >= deadline:
+                    break
+            else:
+                stats.last = self._generator.solver.stats
+                self._finish(context)
+                self.report({'INFO'}, self.message)
+                return {'FINISHED'}
+        except Exception as e:
+            self._finish(context)
+            self.report({'ERROR'}, f"Error: {str(e)}")
+            return {'CANCELLED'}
+        context.workspace.status_text_set(self._status())
+        return {'RUNNING_MODAL'}
+
+    def _status(self):
+        """Status bar text: progress of the current phase and its estimated remaining time"""
+        phase, done, total = self._generator.progress()
+        if phase != self._phase:
+            self._phase = phase
+            self._start = time.perf_counter()
+            done = 0
+        elapsed = time.perf_counter() - self._start
+        eta = f"{elapsed * (total - done) / done:.0f} s" if done else "?"
+        label = "Placing objects" if phase == 'PLACE' else "Solving cells"
+        return f"WFC 3D: {label} {done}/{total} ({100 * done / max(total, 1):.0f}%), ETA {eta} - Esc to cancel"
+
+    def _finish(self, context):
+        context.window_manager.event_timer_remove(self._timer)
+        context.workspace.status_text_set(None)
+        self._steps.close()
+
+
+def region_box(context):
+    """Returns the box [min, max) of the region to re-solve: around the selected objects of the
+    target collection or from the region properties (inclusive cell coordinates)"""
+    props = context.scene.wfc_props
+    if props.resolve_selection:
+        cells = [ tuple(obj["wfc_cell"]) for obj in context.selected_objects
+                  if "wfc_cell" in obj and any(c.name == props.target_collection for c in obj.users_collection) ]
+        if cells:
+            cells = np.array(cells)
+            return tuple(cells.min(axis=0).tolist()), tuple((cells.max(axis=0) + 1).tolist())
+    return tuple(props.resolve_min), tuple(v + 1 for v in props.resolve_max)
+
+
+class OBJECT_OT_WFC3DRegenerateRegion(OBJECT_OT_WFC3DGenerate):
+    """Re-solves a box of the generated model with the cells around it pinned and replaces only
+    the objects of the box (press Esc to cancel)"""
+    bl_idname = "object.wfc_3d_regenerate_region"
+    bl_label = "Regenerate Region"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    message = "WFC region successfully regenerated!"
+
+    def steps(self, context, generator):
+        return generator.region_steps(*region_box(context))
+
+    def execute(self, context):
+        props = context.scene.wfc_props
+        generator = WFC3DGenerator(props.collection_obj, props)
+        for _ in self.steps(context, generator):
+            pass
+        stats.last = generator.solver.stats
+        self.report({'INFO'}, self.message)
+        return {'FINISHED'}
+
+
+operators = [ OBJECT_OT_WFC3DGenerate, OBJECT_OT_WFC3DRegenerateRegion ]
@@ -1,4 +1,7 @@
 import bpy
+
+from . import stats
+
 class WFC3DGeneratePanel(bpy.types.Panel):
     """User interface for WFC 3D Add-On"""
     bl_label = "WFC 3D Generator"
@@ -21,26 +24,58 @@ class WFC3DGeneratePanel(bpy.types.Panel):
         box.row().prop(props, "grid_size")
         box.label(text="Grid Cell Space")
         box.row().prop(props, "spacing")
+        row = box.row()
+        row.prop(props, "use_chunks")
+        sub = row.row()
+        sub.prop(props, "chunk_size")
+        sub.enabled = props.use_chunks and not props.use_streaming
+        row = box.row()
+        row.prop(props, "use_streaming")
+        sub = row.row()
+        sub.prop(props, "stream_axis")
+        sub.prop(props, "stream_window")
+        sub.enabled = props.use_streaming
+        row = box.row()
+        row.prop(props, "stream_file")
+        row.enabled = props.use_streaming
         
         box.prop(props, "use_constraints")
+        row = box.row()
+        row.prop(props, "propagation_mode")
+        row.enabled = props.use_constraints
+        row = box.row()
+        row.prop(props, "use_backtracking")
+        sub = row.row()
+        sub.prop(props, "max_backtracks")
+        sub.enabled = props.use_backtracking
+        row.enabled = props.use_constraints
         
         layout.label(text="Target Collection")
         box = layout.box()
         box.prop(props, "target_collection")
-        box.prop(props, "link_objects")
+        box.prop(props, "placement_mode")
+        row = box.row()
+        row.prop(props, "link_objects")
+        row.enabled = props.placement_mode == 'OBJECTS'
         row=box.row()
         row.prop(props, "copy_modifiers")
-        row.enabled = props.link_objects
-        box.prop(props, "remove_target_collection")
+        row.enabled = props.link_objects and props.placement_mode == 'OBJECTS'
+        row = box.row()
+        row.prop(props, "remove_target_collection")
+        row.enabled = not (props.reuse_objects and props.placement_mode == 'OBJECTS')
+        row = box.row()
+        row.prop(props, "reuse_objects")
+        row.enabled = props.placement_mode == 'OBJECTS'
         
         box = layout.box()
+        box.prop(props, "entropy_mode")
         box.prop(props, "random_start_cell")
         #box.prop(props, "random_direction")
         box.prop(props, "seed")
 
         layout.separator(type="LINE", factor=0.2)
 
-        if props.remove_target_collection and props.target_collection != "" and props.target_collection in bpy.data.collections:
+        if props.remove_target_collection and not (props.reuse_objects and props.placement_mode == 'OBJECTS') and props.target_collection != "" and props.target_collection in bpy.data.collections:
             layout.box().label(text="Target collection will be removed!", icon="WARNING_LARGE")
             
 
@@ -53,7 +88,29 @@ class WFC3DGeneratePanel(bpy.types.Panel):
             layout.label(text="Source and target collection should not be the same.", icon="WARNING_LARGE")
         if props.collection_obj and len(props.collection_obj.objects)==0 and len(props.collection_obj.children)==0:
             layout.label(text="Please select a non-empty source collection.", icon="INFO_LARGE")
-            
+
+        header, body = layout.panel("wfc_3d_region", default_closed=True)
+        header.label(text="Regenerate Region")
+        if body is not None:
+            body.prop(props, "resolve_selection")
+            col = body.column()
+            col.prop(props, "resolve_min")
+            col.prop(props, "resolve_max")
+            row = body.row()
+            row.enabled = props.placement_mode == 'OBJECTS' and props.target_collection in bpy.data.collections and props.collection_obj is not None
+            row.operator("object.wfc_3d_regenerate_region")
+
+        header, body = layout.panel("wfc_3d_stats", default_closed=True)
+        header.label(text="Statistics")
+        if body is not None:
+            if stats.last is None:
+                body.label(text="Generate a model to see its statistics.")
+            else:
+                col = body.column(align=True)
+                for label, value in stats.last.lines():
+                    row = col.row()
+                    row.label(text=label)
+                    row.label(text=value)
 
 
 panels = [ WFC3DGeneratePanel ]
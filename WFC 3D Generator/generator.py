@@ -1,31 +1,48 @@
 import bpy
-import random
+import time
+import numpy as np
 
-from .constraints import WFC3DConstraints
-from .grid import WFC3DGrid
+from .loader import load_ruleset
+from .solver import WFC3DSolver
+from .instances import create_instancer
+from .placement import create_templates
+from .transforms import euler_matrices, matrix_eulers
+from .rng import VARIANT
 
 class WFC3DGenerator:
+    """Blender layer of the generator: loads the ruleset of a collection, runs the WFC3DSolver
+    and places the objects of the solved tiles"""
     def __init__(self, collection, props):
         self.collection = collection
-        self.grid_size = props.grid_size
         self.spacing = props.spacing
         self.use_constraints = props.use_constraints
         self.target_collection = props.target_collection
         self.link_objects = props.link_objects
         self.copy_modifiers = props.copy_modifiers
-        self.random_start_cell = props.random_start_cell
-        
-        random.seed(props.seed)
+        self.placement_mode = props.placement_mode
         self.remove_target_collection = props.remove_target_collection
+        self.reuse_objects = props.reuse_objects
         self.objects = []
-        self.constraints = None
+        self.phase = 'SOLVE'
+        self.placed = 0
+        self.reused = 0
+        self.to_place = 0
         self.load_objects()
 
-        if self.use_constraints:
-            self.constraints = WFC3DConstraints()
-            self.constraints.initialize_constraints(self.objects)
-                    
-        self.grid = WFC3DGrid(self.grid_size)
+        self.solver = WFC3DSolver(load_ruleset(self.objects), props.grid_size, props.seed,
+                                  use_constraints=props.use_constraints,
+                                  propagation_mode=props.propagation_mode,
+                                  entropy_mode=props.entropy_mode,
+                                  random_start_cell=props.random_start_cell,
+                                  use_backtracking=props.use_backtracking,
+                                  max_backtracks=props.max_backtracks,
+                                  use_chunks=props.use_chunks,
+                                  chunk_size=props.chunk_size,
+                                  use_streaming=props.use_streaming,
+                                  stream_axis='XYZ'.index(props.stream_axis),
+                                  stream_window=props.stream_window,
+                                  stream_file=bpy.path.abspath(props.stream_file) if props.stream_file else "")
+        self.constraints = self.solver.constraints
 
     def load_objects(self):
         """Loads objects from the collection"""
@@ -34,108 +51,229 @@ class WFC3DGenerator:
         if not self.objects:
             raise ValueError("Collection is empty!")
 
-    
-    def get_entropy(self, x, y, z):
-        """Calculates the entropy (number of possible states) of a cell"""
-        return len(self.grid.grid[x, y, z])
-
-    def get_lowest_entropy_cell(self):
-        """Finds the cell with the lowest entropy"""
-        min_entropy = float('inf')
-        min_cell = None
-        min_cells = {}
-        for x in range(self.grid_size[0]):
-            for y in range(self.grid_size[1]):
-                for z in range(self.grid_size[2]):
-                    if not self.grid.collapsed[x, y, z]:
-                        entropy = self.get_entropy(x, y, z)
-                        if entropy <= min_entropy:
-                            min_entropy = entropy
-                            min_cell = (x, y, z)
-                            if min_entropy in min_cells:
-                                min_cells[min_entropy].append(min_cell)
-                            else:
-                                min_cells[min_entropy] = [ min_cell ]
-
-        if len(min_cells) == 0:
-            return None
-        
-        if self.random_start_cell:
-            return random.choice(min_cells[min_entropy])
-        else:
-            return min_cells[min_entropy][0]
-        
-    def collapse(self, x, y, z):
-        """Collapses a cell into a single state"""
-        if self.use_constraints:
-            self.constraints.collapse(self.grid, x, y, z)
-        else:
-            self.grid.grid[x, y, z] = [random.choice(self.grid.grid[x,y,z])]
-            self.grid.mark_collapsed(x, y, z)
-
     def generate_model(self):
-        """Excecute WFC algorithm and generate the model"""
-        self.grid.initialize_grid(self.objects, self.constraints)
-        
-        while True:
-            cell = self.get_lowest_entropy_cell()
-            if cell is None:
-                break    
-            x, y, z = cell
-            self.collapse(x, y, z)
-            if self.use_constraints:
-                self.constraints.propagate(self.grid, x, y, z)
-        
-        self.place_objects()
+        """Excecute WFC algorithm and generate the model, returns the WFC3DStats"""
+        for _ in self.steps():
+            pass
+        return self.solver.stats
+
+    def steps(self):
+        """Solves and places step by step: yields after each solver step and each placed object (see progress)"""
+        self.phase = 'SOLVE'
+        try:
+            yield from self.solver.steps()
+            yield from self._place_steps()
+        finally:
+            # also when the generation is cancelled or fails
+            self.solver.close()
+
+    def region_steps(self, box_min, box_max):
+        """Re-solves the cells of the box [box_min, box_max) of the objects placed in the target
+        collection and replaces only their objects, yields like steps"""
+        if self.placement_mode != 'OBJECTS' or self.target_collection not in bpy.data.collections:
+            raise ValueError("Region needs objects placed in the target collection!")
+        self.phase = 'SOLVE'
+        collection = bpy.data.collections[self.target_collection]
+        world = self.placed_world(collection)
+        # each regeneration of the collection draws new tiles
+        nonce = collection.get("wfc_regenerations", 0) + 1
+        collection["wfc_regenerations"] = nonce
+        yield from self.solver.region_steps(world, box_min, box_max, nonce)
+        yield from self._place_steps(self.solver.region)
+
+    def _place_steps(self, region=None):
+        self.phase = 'PLACE'
+        start = time.perf_counter()
+        yield from self.place_steps(region)
+        self.solver.stats.placed = self.placed
+        self.solver.stats.reused = self.reused
+        self.solver.stats.placement_time = time.perf_counter() - start
+
+    def placed_world(self, collection):
+        """Returns the tile ids of the grid (-1 for empty cells) read from the wfc_cell and wfc_tile
+        custom properties of the objects placed in a collection"""
+        tile_ids = {}
+        for tile, obj in enumerate(self.objects):
+            for src in (bpy.data.collections[obj.name].objects if obj.name in bpy.data.collections else [ obj ]):
+                tile_ids[src.name] = tile
+        size = tuple(self.solver.grid_size)
+        world = np.full(size, -1, dtype=np.int32)
+        for obj in collection.objects:
+            cell, tile = obj.get("wfc_cell"), tile_ids.get(obj.get("wfc_tile"))
+            if cell is not None and tile is not None and all(0 <= c < s for c, s in zip(cell, size)):
+                world[tuple(cell)] = tile
+        return world
+
+    def progress(self):
+        """Returns the phase ('SOLVE' or 'PLACE'), the solved cells or placed objects and their total"""
+        if self.phase == 'PLACE':
+            return self.phase, self.placed, self.to_place
+        return self.phase, self.solver.progress(), self.solver.stats.cells or int(np.prod(self.solver.grid_size))
 
     def place_objects(self):
-        """Place the objects in 3D space"""
-        # Create a new collection for the result
+        """Place the objects in 3D space, returns the number of placed objects"""
+        for _ in self.place_steps():
+            pass
+        return self.placed
+
+    def place_steps(self, region=None):
+        """Places the objects, yields after each object (or each solved chunk for instances). With a
+        region (slices of a re-solved box), only the objects of the box are updated"""
+        self.placed = 0
+        self.reused = 0
+        self.to_place = self.solver.count_tiles()
         collection_name = self.target_collection
-        if self.remove_target_collection and collection_name in bpy.data.collections:
-            bpy.data.collections.remove(bpy.data.collections[collection_name])
-        
-        new_collection = bpy.data.collections.new(collection_name)
-        bpy.context.scene.collection.children.link(new_collection)
+        reuse = region is not None or (self.reuse_objects and self.placement_mode == 'OBJECTS' and collection_name in bpy.data.collections)
+        if reuse:
+            new_collection = bpy.data.collections[collection_name]
+        else:
+            # Create a new collection for the result
+            if self.remove_target_collection and collection_name in bpy.data.collections:
+                bpy.data.collections.remove(bpy.data.collections[collection_name])
+            new_collection = bpy.data.collections.new(collection_name)
+            bpy.context.scene.collection.children.link(new_collection)
         
+        if self.placement_mode == 'INSTANCES':
+            yield from self.place_instances(new_collection)
+            return
         
-        # Place objects
-        for x in range(self.grid_size[0]):
-            for y in range(self.grid_size[1]):
-                for z in range(self.grid_size[2]):
-                    if len(self.grid.grid[x,y,z]) > 0:
-                        obj_name = self.grid.grid[x, y, z][0]
-                    else:
-                        continue
-                    # pick random  objects from a collection
-                    if obj_name in bpy.data.collections:
-                        c = bpy.data.collections[obj_name]
-                        original_obj = random.choice(c.objects)
+        # Place objects: per cell only the object of the prepared tile template is created or the
+        # object of the previous result is reused, all objects are moved at once after the loop
+        # (also when the placement is cancelled)
+        templates = create_templates(self.objects, self.link_objects, self.copy_modifiers)
+        spacing = np.array(self.spacing)
+        objects, previous, removed = self.previous_objects(new_collection, region) if reuse else ([], {}, [])
+        created = []
+        # position of the object of each placed cell in objects + created
+        keys, cells, tiles, variants = [], [], [], []
+        try:
+            for origin, chunk in self.solver.results():
+                filled = chunk >= 0
+                cells.append(np.argwhere(filled) + origin)
+                tiles.append(chunk[filled])
+                draws = self.solver.random.randoms(VARIANT, self.world_index(cells[-1]))
+                for cell, tile, u in zip(cells[-1].tolist(), tiles[-1].tolist(), draws.tolist()):
+                    template = templates[tile]
+                    key, obj = previous.pop(tuple(cell), (-1, None))
+                    variant = template.variant(obj.get("wfc_tile")) if obj is not None else None
+                    if variant is None:
+                        variant = template.choose(u)
+                        if obj is not None and variant.retarget(obj):
+                            obj["wfc_tile"] = variant.obj.name
+                        elif obj is not None:
+                            bpy.data.objects.remove(obj)
+                            removed.append(key)
+                            obj = None
+                    if obj is None:
+                        obj = variant.stamp()
+                        obj["wfc_cell"] = cell
+                        obj["wfc_tile"] = variant.obj.name
+                        new_collection.objects.link(obj)
+                        key = len(objects) + len(created)
+                        created.append(obj)
                     else:
-                        original_obj = next((obj for obj in self.objects if obj.name == obj_name), None)
-                    
-                    if original_obj:
-                        if self.link_objects:
-                            new_obj = bpy.data.objects.new(name=original_obj.name, object_data = original_obj.data)
-                            if self.copy_modifiers:
-                                for mod in original_obj.modifiers:
-                                    new_mod = new_obj.modifiers.new(name=mod.name, type=mod.type)
-                                    for attr in dir(mod):
-                                        if attr.startswith("_"):
-                                            continue
-                                        try:
-                                            setattr(new_mod, attr, getattr(mod, attr))
-                                        except Exception:
-                                            pass
-                        else:
-                            new_obj = original_obj.copy()
-                            new_obj.data = original_obj.data.copy()
-                            
-                        newloc = [ x * self.spacing[0],  y * self.spacing[1], z * self.spacing[2] ]                        
-                        new_obj.location = tuple(newloc)        
-
-                        if self.use_constraints:
-                            self.constraints.apply_transformation_constraints(original_obj, new_obj)
-                            
-                        new_collection.objects.link(new_obj)
+                        self.reused += 1
+                    keys.append(key)
+                    variants.append(variant)
+                    self.placed += 1
+                    yield
+            # objects of cells that are empty now
+            for key, obj in previous.values():
+                bpy.data.objects.remove(obj)
+                removed.append(key)
+        finally:
+            kept = np.ones(len(objects) + len(created), dtype=bool)
+            kept[removed] = False
+            self.move_objects(new_collection, (np.cumsum(kept) - 1)[keys], cells, tiles, variants)
+
+    def previous_objects(self, collection, region=None):
+        """Returns the objects of a collection, a dict cell => (position, object) of the placed objects
+        (wfc_cell and wfc_tile custom properties, only in the region if given) and the positions of
+        removed duplicates of a cell"""
+        objects = list(collection.objects)
+        previous = {}
+        removed = []
+        for position, obj in enumerate(objects):
+            cell = obj.get("wfc_cell")
+            if cell is None or "wfc_tile" not in obj:
+                continue
+            cell = tuple(cell)
+            if region is not None and not all(s.start <= c < s.stop for c, s in zip(cell, region)):
+                continue
+            if cell in previous:
+                bpy.data.objects.remove(obj)
+                removed.append(position)
+            else:
+                previous[cell] = (position, obj)
+        return objects, previous, removed
+
+    def world_index(self, cells):
+        """Returns the linear world indices of cells (N, 3), the cell keys of their random draws"""
+        return np.ravel_multi_index(tuple(np.asarray(cells).reshape(-1, 3).T), self.solver.grid_size)
+
+    def transforms(self):
+        """Returns the transformation sampler or None if no transformation constraint is used"""
+        if self.use_constraints and self.constraints.model.active['transformation']:
+            return self.constraints.transforms
+        return None
+
+    def move_objects(self, collection, index, cells, tiles, variants):
+        """Sets location, rotation and scale of the placed objects of cells (index: their position in
+        the collection) with foreach_set, the transformation constraints of all cells are sampled at once"""
+        n = len(variants)
+        if n == 0:
+            return
+        objects = collection.objects
+        values = { attr: np.zeros((len(objects), 3), dtype=np.float32) for attr in ('location', 'rotation_euler', 'scale') }
+        if len(objects) > n:
+            # the other objects of the collection keep their values
+            for attr, value in values.items():
+                objects.foreach_get(attr, value.ravel())
+        cells = np.concatenate(cells)[:n]
+        locations = cells * np.array(self.spacing)
+        rotations = np.array([ v.rotation_euler for v in variants ])
+        scales = np.array([ v.scale for v in variants ])
+        transforms = self.transforms()
+        if transforms is not None:
+            offsets, angles, sampled, scaled = transforms.sample(np.concatenate(tiles)[:n], self.world_index(cells), self.solver.random)
+            rotations = matrix_eulers(transforms.rotations(angles, euler_matrices(rotations)))
+            scales = np.where(scaled[:, np.newaxis], sampled, scales)
+            locations = locations + offsets
+        values['location'][index] = locations
+        values['rotation_euler'][index] = rotations
+        values['scale'][index] = scales
+        for attr, value in values.items():
+            objects.foreach_set(attr, value.ravel())
+
+    def place_instances(self, collection):
+        """Places one point per non-empty cell (tile, instance, rotation and scale as point attributes)
+        and instances the tiles on the points with Geometry Nodes, yields after each solved chunk"""
+        # instanced objects: the tile object or all objects of a tile collection (random variant per cell)
+        sources = []
+        first = np.zeros(len(self.objects), dtype=np.int32)
+        variants = np.zeros(len(self.objects), dtype=np.int32)
+        for tile, obj in enumerate(self.objects):
+            objects = list(bpy.data.collections[obj.name].objects) if obj.name in bpy.data.collections else [ obj ]
+            first[tile], variants[tile] = len(sources), len(objects)
+            sources.extend(objects)
 
+        cells, tiles = [], []
+        for origin, chunk in self.solver.results():
+            filled = chunk >= 0
+            cells.append(np.argwhere(filled) + origin)
+            tiles.append(chunk[filled].astype(np.int32))
+            self.placed += len(tiles[-1])
+            yield
+        cells = np.concatenate(cells)
+        positions = cells * np.array(self.spacing)
+        tiles = np.concatenate(tiles)
+        keys = self.world_index(cells)
+        instances = first[tiles] + (self.solver.random.randoms(VARIANT, keys) * variants[tiles]).astype(np.int32)
+        rotations = np.zeros((len(tiles), 3))
+        scales = np.ones((len(tiles), 3))
+        transforms = self.transforms()
+        if transforms is not None:
+            offsets, angles, scales, _ = transforms.sample(tiles, keys, self.solver.random)
+            positions = positions + offsets
+            rotations = matrix_eulers(transforms.rotations(angles))
+        create_instancer(self.target_collection, collection, positions, tiles, instances, rotations, scales, sources)
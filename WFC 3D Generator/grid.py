@@ -1,191 +1,520 @@
+import math
 import numpy as np
-from .constants import DIRECTIONS
-import random
+from collections import deque
+from functools import lru_cache
+from itertools import product
+from .constants import DIRECTIONS, FACE_DIRECTIONS, CORNER_DIRECTIONS, EDGE_DIRECTIONS
+from .rng import PRUNE
+
+@lru_cache(maxsize=8)
+def neighbor_table(grid_size):
+    """Returns a (cells, 26) array with the linear index of each neighbor (in DIRECTIONS order) or -1 outside the grid"""
+    coords = np.indices(grid_size).reshape(3, -1)
+    table = np.full((coords.shape[1], len(DIRECTIONS)), -1, dtype=np.int32)
+    for k, d in enumerate(DIRECTIONS.values()):
+        n = coords + np.array(d).reshape(3, 1)
+        inside = np.all((n >= 0) & (n < np.array(grid_size).reshape(3, 1)), axis=0)
+        table[inside, k] = np.ravel_multi_index(n[:, inside], grid_size)
+    table.flags.writeable = False
+    return table
+
+# neighborhood families of the frequency constraints and the family of each direction (DIRECTIONS order)
+NEIGHBOR_FAMILIES = [ FACE_DIRECTIONS, CORNER_DIRECTIONS, EDGE_DIRECTIONS ]
+DIRECTION_FAMILY = np.array([ next(i for i, f in enumerate(NEIGHBOR_FAMILIES) if d in f) for d in DIRECTIONS ])
+
+INSIDE, FACE, EDGE, CORNER = 0, 1, 2, 3
+FACE_NAMES = ['front', 'back', 'top', 'bottom', 'left', 'right']
+
+@lru_cache(maxsize=8)
+def grid_labels(grid_size, origin=(0, 0, 0), shape=None):
+    """Classifies all cells of a grid size once.
+
+    Returns a dict of label volumes: 'kind' (INSIDE, FACE, EDGE or CORNER) and bit masks of the
+    corners ('corner_bits'), edges ('edge_bits') and faces ('face_bits') a cell belongs to
+    (bit i = i-th name of grid.corners, grid.edges and FACE_NAMES). With origin and shape the
+    volumes only cover this box of the grid.
+    """
+    grid = WFC3DGrid(grid_size)
+    l, w, h = grid.grid_size
+    shape = grid.grid_size if shape is None else tuple(shape)
+    pos = np.indices(shape) + np.array(origin).reshape(3, 1, 1, 1)
+    x, y, z = pos
+    bx, by, bz = (x == 0) | (x == l-1), (y == 0) | (y == w-1), (z == 0) | (z == h-1)
+    inner_x, inner_y, inner_z = (0 < x) & (x < l-1), (0 < y) & (y < w-1), (0 < z) & (z < h-1)
+    corner = bx & by & bz
+    edge = ~corner & (bx.astype(int) + by + bz >= 2)
+    inside = inner_x & inner_y & inner_z
+    kind = np.full(shape, FACE, dtype=np.int8)
+    kind[inside] = INSIDE
+    kind[edge] = EDGE
+    kind[corner] = CORNER
+
+    corner_bits = np.zeros(shape, dtype=np.uint8)
+    for i, c in enumerate(grid.corners.values()):
+        corner_bits[(x == c[0]) & (y == c[1]) & (z == c[2])] |= 1 << i
+    edge_bits = np.zeros(shape, dtype=np.uint16)
+    for i, (a, b) in enumerate(grid.edges.values()):
+        if a == b:
+            continue
+        # an edge runs along the axis where both corners differ
+        on_edge = np.ones(shape, dtype=bool)
+        for axis in range(3):
+            if a[axis] == b[axis]:
+                on_edge &= pos[axis] == a[axis]
+        edge_bits[on_edge] |= 1 << i
+    faces = {
+        'front': (y == 0) & inner_x & inner_z, 'back': (y == w-1) & inner_x & inner_z,
+        'top': (z == h-1) & inner_x & inner_y, 'bottom': (z == 0) & inner_x & inner_y,
+        'left': (x == 0) & inner_y & inner_z, 'right': (x == l-1) & inner_y & inner_z,
+    }
+    face_bits = np.zeros(shape, dtype=np.uint8)
+    for i, f in enumerate(FACE_NAMES):
+        face_bits[faces[f]] |= 1 << i
+
+    labels = { 'kind': kind, 'corner_bits': corner_bits, 'edge_bits': edge_bits, 'face_bits': face_bits }
+    for volume in labels.values():
+        volume.flags.writeable = False
+    return labels
+
+def symmetry_points(coords, grid_size, mirror_axes=(False, False, False), rotate_axis=None, n_rotations=1):
+    """Returns the mirrored and/or rotated coordinates (N, 3) of cells of a grid, one array per
+    symmetry operation (rounded, may be outside the grid). Mirroring flips the selected axes at
+    the grid center, rotations turn n times by 360/n degrees around an axis through the grid center.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    center = (np.array(grid_size) - 1) / 2
+    points = []
+    for flips in product(*([False, True] if m else [False] for m in mirror_axes)):
+        q = coords.copy()
+        q[:, flips] = 2 * center[list(flips)] - q[:, flips]
+        points.append(q)
+
+    axis = None if rotate_axis is None else np.array(rotate_axis, dtype=float)
+    if axis is not None and n_rotations > 1 and np.linalg.norm(axis) > 0:
+        x, y, z = axis / np.linalg.norm(axis)
+        k = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+        rotations = []
+        for i in range(n_rotations):
+            theta = 2 * np.pi / n_rotations * i
+            r = np.eye(3) + np.sin(theta) * k + (1 - np.cos(theta)) * (k @ k)
+            rotations.extend((q - center) @ r.T + center for q in points)
+        points = rotations
+    return [ np.round(q).astype(int) for q in points ]
+
+@lru_cache(maxsize=32)
+def symmetry_orbits(grid_size, mirror_axes=(False, False, False), rotate_axis=None, n_rotations=1):
+    """Returns a (cells, members) int32 array with the linear indices of the mirrored and/or rotated
+    cells of each cell (padded with -1), see symmetry_points
+    """
+    coords = np.indices(grid_size).reshape(3, -1).T
+    points = symmetry_points(coords, grid_size, mirror_axes, rotate_axis, n_rotations)
+    members = np.full((coords.shape[0], len(points)), -1, dtype=np.int32)
+    for i, q in enumerate(points):
+        inside = np.all((q >= 0) & (q < np.array(grid_size)), axis=1)
+        members[inside, i] = np.ravel_multi_index(q[inside].T, grid_size)
+    members.sort(axis=1)
+    members[:, 1:][members[:, 1:] == members[:, :-1]] = -1
+    members.flags.writeable = False
+    return members
+
+def _allowed_bits(values, names, forbidden):
+    """Bit mask of the names permitted by a list of grid constraint values, -1 permits all"""
+    if len(values) == 1 and values[0] == '':
+        return -1
+    bits = 0
+    for v in values:
+        if v in forbidden:
+            break
+        if v in names:
+            bits |= 1 << names.index(v)
+    return bits
 
 class WFC3DGrid:
-    def __init__(self, grid_size):
-        self.grid_size = grid_size;        
-        self.grid = None
+    """Domains of a grid or of a box (origin, grid_size) of a larger world grid (world_size),
+    grid and region constraints always refer to the world grid"""
+    def __init__(self, grid_size, origin=(0, 0, 0), world_size=None):
+        self.grid_size = tuple(grid_size)
+        self.origin = tuple(origin)
+        self.world_size = self.grid_size if world_size is None else tuple(world_size)
+        self.tiles = []
+        self.domains = None
+        self.collapsed = None
+        self.changed = []
+        self.dirty = deque()
+        self.contradiction = False
+        self.trail = None
+        self.weights = None
+        self.tile_counts = None
+        self.tile_cells = {}
+        self.tracked = None
+        self.line_counts = None
+        self.neighbor_counts = None
         self._init_corners()
         self._init_edges()
         
-    def initialize_grid(self, objects, constraints):
-        """Initializes the 3D grid"""
-        self.grid = np.empty(self.grid_size, dtype=object)
-        self.collapsed = np.empty(self.grid_size)
-        for x in range(self.grid_size[0]):
-            for y in range(self.grid_size[1]):
-                for z in range(self.grid_size[2]):
-                    cell = []
-                    for obj in objects:
-                        if constraints is None or self.are_grid_constraints_satisfied(obj.name, constraints.constraints, (x, y, z)):
-                            cell.append(obj.name)
-                    
-                    self.grid[x, y, z] = cell
-                    self.collapsed[x, y, z] = False
-    
-    def is_corner(self, pos):
-        x, y, z = pos
-        l, w, h = self.grid_size
-        return (x in {0, l-1} and y in {0, w-1} and z in {0, h-1})
-    
-    def is_edge(self, pos):
-        x, y, z = pos
-        l, w, h = self.grid_size
-        if self.is_corner(pos):
-            return False
-        return (x in {0, l-1} and (y in {0, w-1} or z in {0, h-1})) or \
-               (y in {0, w-1} and (x in {0, l-1} or z in {0, h-1})) or \
-               (z in {0, h-1} and (x in {0, l-1} or y in {0, w-1}))
-    
-    def is_inside(self, pos):
-        x, y, z = pos
-        l, w, h = self.grid_size
-        return 0 < x < l-1 and 0 < y < w-1 and 0 < z < h-1
-    
-    def is_on_given_edge(self, p, edge):
-        a,b = edge
-        dx, dy, dz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
-        px, py, pz = p[0] - a[0], p[1] - a[1], p[2] - a[2]
-        t_values = []
-        for dp, d in zip((px, py, pz), (dx, dy, dz)):
-            if d != 0:
-                t_values.append(dp / d)
-            else:
-                if dp != 0:
-                    return False    
-        if not t_values:
-            return False  
-        if not all(abs(t - t_values[0]) < 1e-9 for t in t_values):
-            return False    
-        t = t_values[0]
-        return 0 <= t <= 1
-
-    def is_face(self, pos):
-        x, y, z = pos
-        l, w, h = self.grid_size
-        return not self.is_corner(pos) and not self.is_edge(pos) and not self.is_inside(pos)
-    
-    def is_on_specific_face(self, pos, face):
-        x, y, z = pos
-        l, w, h = self.grid_size
-        if face == "top":
-            return z == h-1 and 0 < x < l-1 and 0 < y < w-1
-        elif face == "bottom":
-            return z == 0 and 0 < x < l-1 and 0 < y < w-1
-        elif face == "left":
-            return x == 0 and 0 < y < w-1 and 0 < z < h-1
-        elif face == "right":
-            return x == l-1 and 0 < y < w-1 and 0 < z < h-1
-        elif face == "front":
-            return y == 0 and 0 < x < l-1 and 0 < z < h-1
-        elif face == "back":
-            return y == w-1 and 0 < x < l-1 and 0 < z < h-1
+    def initialize_grid(self, tiles, model):
+        """Initializes the 3D grid: one boolean domain vector (indexed by tile id) per cell"""
+        self.tiles = list(tiles)
+        self.domains = np.ones((*self.grid_size, len(self.tiles)), dtype=bool)
+        self.collapsed = np.zeros(self.grid_size, dtype=bool)
+        self.changed = []
+        self.dirty = deque()
+        self.contradiction = False
+        self.trail = None
+        self.weights = None
+        self.tile_counts = np.zeros(len(self.tiles), dtype=np.int64)
+        self.tile_cells = {}
+        self.line_counts = None
+        self.neighbor_counts = None
+        if model is None:
+            return
+        for tile, constraint in enumerate(model.grid_constraints):
+            self.domains[..., tile] = self.grid_constraint_mask(constraint)
+
+    def grid_constraint_mask(self, constraint):
+        """Returns a boolean volume of the cells permitted by the grid and region constraints of an object"""
+        labels = grid_labels(self.world_size, self.origin, self.grid_size)
+        kind = labels['kind']
+        mask = self.region_mask(constraint.get('region_min'), constraint.get('region_max'))
+        rules = [ ('corners', CORNER, 'corner_bits', list(self.corners), ('-', 'None', 'False')),
+                  ('edges', EDGE, 'edge_bits', list(self.edges), ('-', 'None')),
+                  ('faces', FACE, 'face_bits', FACE_NAMES, ('-', 'None', 'False')) ]
+        for key, k, bits, names, forbidden in rules:
+            if key in constraint:
+                cells = kind == k
+                allowed = _allowed_bits(constraint[key], names, forbidden)
+                mask[cells] = allowed == -1 or (labels[bits][cells] & allowed) != 0
+        if 'inside' in constraint:
+            # any inside constraint forbids the inside cells
+            mask[kind == INSIDE] = False
+        return mask
+
+    def region_mask(self, rmin, rmax):
+        """Returns a boolean volume of the cells inside a region (negative or missing bounds are unbounded)"""
+        mask = np.ones(self.grid_size, dtype=bool)
+        for axis, size in enumerate(self.grid_size):
+            a = 0 if rmin is None or rmin[axis] < 0 else rmin[axis]
+            b = self.world_size[axis]-1 if rmax is None or rmax[axis] < 0 else rmax[axis]
+            line = np.arange(size) + self.origin[axis]
+            shape = [1, 1, 1]
+            shape[axis] = size
+            mask &= ((a <= line) & (line <= b)).reshape(shape)
+        return mask
+
+    @property
+    def cells(self):
+        """Domains as a (cells, tiles) view indexed by the linear cell index"""
+        return self.domains.reshape(-1, len(self.tiles))
+
+    @property
+    def neighbors(self):
+        return neighbor_table(self.grid_size)
+
+    def index(self, x, y, z):
+        return (x * self.grid_size[1] + y) * self.grid_size[2] + z
+
+    def coords(self, idx):
+        x, yz = divmod(idx, self.grid_size[1] * self.grid_size[2])
+        y, z = divmod(yz, self.grid_size[2])
+        return x, y, z
+
+    def symmetry_members(self, x, y, z, mirror_axes, rotate_axis=None, n_rotations=1):
+        """Returns the linear indices of the mirrored and/or rotated cells of a cell (itself included).
+        Symmetry always refers to the world grid: in a box of a larger world the members outside
+        the box are dropped"""
+        if self.world_size == self.grid_size:
+            members = symmetry_orbits(self.grid_size, mirror_axes, rotate_axis, n_rotations)[self.index(x, y, z)]
+            return members[members >= 0]
+        cell = np.add((x, y, z), self.origin)
+        q = np.concatenate(symmetry_points(cell, self.world_size, mirror_axes, rotate_axis, n_rotations)) - np.array(self.origin)
+        q = q[np.all((q >= 0) & (q < np.array(self.grid_size)), axis=1)]
+        return np.unique(np.ravel_multi_index(q.T, self.grid_size))
+
+    def world_index(self, x, y, z):
+        """Returns the linear index of a cell in the world grid (the cell key of its random draws)"""
+        ox, oy, oz = self.origin
+        return ((x + ox) * self.world_size[1] + y + oy) * self.world_size[2] + z + oz
+
+    def options(self, x, y, z):
+        """Returns the tile ids still allowed in a cell"""
+        return np.flatnonzero(self.domains[x, y, z])
+
+    def count(self, x, y, z):
+        """Returns the number of tiles still allowed in a cell"""
+        return int(np.count_nonzero(self.domains[x, y, z]))
+
+    def counts(self):
+        """Returns the number of allowed tiles of all cells"""
+        return np.count_nonzero(self.domains, axis=3)
+
+    def is_empty(self, x, y, z):
+        return not self.domains[x, y, z].any()
+
+    def tile(self, x, y, z):
+        """Returns the first allowed tile id of a cell or -1 for an empty cell"""
+        options = self.domains[x, y, z]
+        return int(options.argmax()) if options.any() else -1
+
+    def _touch(self, idx):
+        self.changed.append(idx)
+        self.dirty.append(idx)
+
+    def _check(self, idx):
+        """A cell emptied by propagation or frequency constraints is a contradiction (clear() creates holes on purpose)"""
+        if not self.cells[idx].any() and not self.collapsed.flat[idx]:
+            self.contradiction = True
+
+    def _remove_weights(self, idx, removed):
+        """Updates the running weight sums of cell(s) for a mask of removed tiles"""
+        if self.weights is not None:
+            self.sum_w[idx] -= removed @ self.weights
+            self.sum_wlogw[idx] -= removed @ self.wlogw
+
+    def enable_weights(self, weights):
+        """Keeps per cell sums of w and w*log(w) of the allowed tiles for the weighted entropy"""
+        self.weights = np.asarray(weights, dtype=float)
+        self.wlogw = self.weights * np.log(np.where(self.weights > 0, self.weights, 1))
+        self.sum_w = self.cells @ self.weights
+        self.sum_wlogw = self.cells @ self.wlogw
+
+    def entropy(self, idx):
+        """Shannon entropy of the weights of a cell: log(sum(w)) - sum(w*log(w))/sum(w)"""
+        sum_w = self.sum_w[idx]
+        if sum_w <= 0:
+            return 0.0
+        return math.log(sum_w) - self.sum_wlogw[idx] / sum_w
+
+    def entropies(self):
+        sum_w = np.where(self.sum_w > 0, self.sum_w, 1)
+        return (np.log(sum_w) - self.sum_wlogw / sum_w).reshape(self.grid_size)
+
+    def _write(self, idx, options):
+        """Sets the domain of a cell and keeps trail, weight sums, tile counters and queues up to date"""
+        self._save(idx)
+        old = self.cells[idx].copy()
+        self._remove_weights(idx, old & ~options)
+        if self.collapsed.flat[idx]:
+            self.tile_counts += options.astype(np.int64) - old
+        elif self.tile_cells:
+            for tile in np.flatnonzero((old ^ options) & self.tracked).tolist():
+                if options[tile]:
+                    self.tile_cells[tile].add(idx)
+                else:
+                    self.tile_cells[tile].discard(idx)
+        if self.line_counts is not None or self.neighbor_counts is not None:
+            self._update_counts(np.array([idx]), old[np.newaxis], options[np.newaxis])
+        self.cells[idx] = options
+        self._touch(idx)
+
+    def _write_many(self, idx, options):
+        """Sets the domains of many cells at once (idx: array of linear cell indices)"""
+        self._save(idx)
+        old = self.cells[idx]
+        self._remove_weights(idx, old & ~options)
+        collapsed = self.collapsed.reshape(-1)[idx]
+        if collapsed.any():
+            self.tile_counts += options[collapsed].sum(axis=0) - old[collapsed].sum(axis=0)
+        if self.tile_cells:
+            self._update_tile_cells(idx[~collapsed], old[~collapsed], options[~collapsed])
+        if self.line_counts is not None or self.neighbor_counts is not None:
+            self._update_counts(idx, old, options)
+        self.cells[idx] = options
+        idx = idx.tolist()
+        self.changed.extend(idx)
+        self.dirty.extend(idx)
+
+    def _update_tile_cells(self, idx, old, new):
+        """Updates the inverted index of the tracked tiles for open cells whose domains changed from old to new"""
+        for tile in np.flatnonzero(((old ^ new) & self.tracked).any(axis=0)).tolist():
+            self.tile_cells[tile].difference_update(idx[old[:, tile] & ~new[:, tile]].tolist())
+            self.tile_cells[tile].update(idx[new[:, tile] & ~old[:, tile]].tolist())
+
+    def track_tiles(self, tiles):
+        """Keeps an inverted index tile => uncollapsed cells that still allow the tile for the given tiles"""
+        self.tracked = np.zeros(len(self.tiles), dtype=bool)
+        self.tracked[tiles] = True
+        open_cells = ~self.collapsed.reshape(-1)
+        self.tile_cells = { tile: set(np.flatnonzero(self.cells[:, tile] & open_cells).tolist()) for tile in tiles }
+
+    def _with_any(self, domains):
+        """Appends a column 'any tile allowed' to (cells, tiles) domains as counter increments"""
+        return np.concatenate([domains, domains.any(axis=1, keepdims=True)], axis=1).astype(np.int32)
+
+    def enable_counts(self, lines=True, neighborhoods=True):
+        """Maintains counters of the cells allowing each tile (last column: of the non-empty cells)
+        per grid line (line_counts[axis], indexed by the two other coordinates) and per
+        neighborhood family of each cell (neighbor_counts[family, cell], see NEIGHBOR_FAMILIES)
+        """
+        counts = self._with_any(self.cells)
+        volume = counts.reshape(*self.grid_size, -1)
+        self.line_counts = [ volume.sum(axis=axis) for axis in range(3) ] if lines else None
+        self.neighbor_counts = None
+        if neighborhoods:
+            self.neighbor_counts = np.zeros((len(NEIGHBOR_FAMILIES), *counts.shape), dtype=np.uint8)
+            for k, family in enumerate(DIRECTION_FAMILY.tolist()):
+                m = self.neighbors[:, k]
+                inside = m >= 0
+                self.neighbor_counts[family, inside] += counts[m[inside]].astype(np.uint8)
+
+    def add_line_counts(self, axis, counts):
+        """Adds counts of cells outside the grid to the line counters of an axis (e.g. of solved slices)"""
+        if self.line_counts is not None:
+            self.line_counts[axis] += counts
+
+    def _update_counts(self, idx, old, new):
+        """Updates line and neighborhood counters for cells whose domains changed from old to new"""
+        delta = self._with_any(new) - self._with_any(old)
+        changed = delta.any(axis=1)
+        if not changed.any():
+            return
+        idx, delta = idx[changed], delta[changed]
+        if self.line_counts is not None:
+            x, y, z = self.coords(idx)
+            np.add.at(self.line_counts[0], (y, z), delta)
+            np.add.at(self.line_counts[1], (x, z), delta)
+            np.add.at(self.line_counts[2], (x, y), delta)
+        if self.neighbor_counts is not None:
+            # a cell is a neighbor of its neighbors in the same family
+            neighbors = self.neighbors[idx]
+            cell, k = np.nonzero(neighbors >= 0)
+            np.add.at(self.neighbor_counts, (DIRECTION_FAMILY[k], neighbors[cell, k]), delta[cell].astype(np.uint8))
+
+    def assign(self, x, y, z, tile):
+        options = np.zeros(len(self.tiles), dtype=bool)
+        options[tile] = True
+        self._write(self.index(x, y, z), options)
+
+    def clear(self, x, y, z):
+        self._write(self.index(x, y, z), np.zeros(len(self.tiles), dtype=bool))
+
+    def set_cell_options(self, idx, options):
+        self._write(idx, options)
+        self._check(idx)
+
+    def set_cells_options(self, idx, options):
+        """Sets the domains of many cells at once (idx: array of linear cell indices)"""
+        self._write_many(idx, options)
+        if (~options.any(axis=1) & ~self.collapsed.reshape(-1)[idx]).any():
+            self.contradiction = True
+
+    def ban(self, x, y, z, tile):
+        idx = self.index(x, y, z)
+        options = self.cells[idx].copy()
+        options[tile] = False
+        self._write(idx, options)
+        self._check(idx)
+
+    def enable_trail(self):
+        """Records all domain changes on an undo trail, push_level() marks a decision"""
+        self.trail = []
+        self.levels = []
+        self.saved = np.full(self.collapsed.size, -1, dtype=np.int32)
+
+    def _save(self, idx):
+        """Saves the state of cell(s) once per decision level before they are changed"""
+        if self.trail is None or not self.levels:
+            return
+        level = len(self.levels)
+        idx = np.atleast_1d(idx)
+        idx = idx[self.saved[idx] != level]
+        if idx.size == 0:
+            return
+        self.saved[idx] = level
+        self.trail.append((idx, np.packbits(self.cells[idx], axis=1), self.collapsed.reshape(-1)[idx]))
+
+    def push_level(self):
+        self.levels.append(len(self.trail))
+
+    def pop_level(self):
+        """Restores all cells changed since the last push_level() and returns their indices"""
+        start = self.levels.pop()
+        entries = self.trail[start:]
+        del self.trail[start:]
+        if not entries:
+            restored = np.empty(0, dtype=np.int64)
         else:
-            return False
+            restored = np.unique(np.concatenate([ idx for idx, _, _ in entries ]))
+        before, collapsed_before = self.cells[restored], self.collapsed.reshape(-1)[restored]
+        for idx, domains, collapsed in reversed(entries):
+            self.cells[idx] = np.unpackbits(domains, axis=1, count=len(self.tiles)).astype(bool)
+            self.collapsed.reshape(-1)[idx] = collapsed
+            self.saved[idx] = -1
+        after, collapsed_after = self.cells[restored], self.collapsed.reshape(-1)[restored]
 
+        self.tile_counts += after[collapsed_after].sum(axis=0) - before[collapsed_before].sum(axis=0)
+        if self.tile_cells:
+            self._update_tile_cells(restored, before & ~collapsed_before[:, np.newaxis], after & ~collapsed_after[:, np.newaxis])
+        if self.line_counts is not None or self.neighbor_counts is not None:
+            self._update_counts(restored, before, after)
+        if self.weights is not None:
+            self.sum_w[restored] = after @ self.weights
+            self.sum_wlogw[restored] = after @ self.wlogw
+        self.changed.extend(restored.tolist())
+        self.dirty.clear()
+        self.contradiction = False
+        return restored
+
+    def pop_changed(self):
+        """Returns and resets the (linear) cell indices whose domains have been changed since the last call"""
+        changed = self.changed
+        self.changed = []
+        return changed
+
+    def result(self):
+        """Returns an integer array with the tile id of each cell (-1 for empty cells)"""
+        return np.where(self.domains.any(axis=3), self.domains.argmax(axis=3), -1)
+    
     def within_boundaries(self, x, y, z):
         return 0 <= x < self.grid_size[0] and 0 <= y < self.grid_size[1] and 0 <= z < self.grid_size[2]
 
-    def are_grid_constraints_satisfied(self, name, constraints, pos):
-        if 'corners' in constraints[name] and self.is_corner(pos):
-            for c in constraints[name]['corners']:
-                if c == '' and len(constraints[name]['corners'])==1:
-                    return True
-                if c == '-' or c == 'None' or c == 'False':
-                    return False
-                if c in self.corners and pos == self.corners[c]:
-                    return True
-            return False
-        if 'edges' in constraints[name] and self.is_edge(pos):
-            for c in constraints[name]['edges']:
-                if c == '' and len(constraints[name]['edges'])==1:
-                    return True
-                if c == '-' or c == 'None':
-                    return False
-                if c in self.edges and self.is_on_given_edge(pos, self.edges[c]):
-                    return True
-            return False
-        if 'inside' in constraints[name] and self.is_inside(pos):
-            inside = constraints[name]['inside']
-            if inside == '' or inside == 'True':
-                return True
-            if inside == '-' or inside == 'None' or inside == 'False':
-                return False
-            return False
-        if 'faces' in constraints[name] and self.is_face(pos):
-            for f in constraints[name]['faces']:
-                if f == '' and len(constraints[name]['faces'])==1:
-                    return True
-                if f == '-' or f == 'None' or f == 'False':
-                    return False
-                if self.is_on_specific_face(pos,f):
-                    return True
-            return False
-        if 'region_min' in constraints[name] or 'region_max' in constraints[name]:
-            return self.is_inside_region(pos, constraints[name].get('region_min',None), constraints[name].get('region_max',None))
-        
-        return True
-    
-    def is_inside_region(self, pos, rmin, rmax):
-        x,y,z = pos
-        if rmin is None:
-            ax,ay,az = (0,0,0)
-        else:
-            ax,ay,az = rmin
-            if ax < 0:
-                ax = 0
-            if ay < 0:
-                ay = 0
-            if az < 0:
-                az = 0
-        if rmax is None:
-            bx,by,bz = (self.grid_size[0]-1,self.grid_size[1]-1,self.grid_size[2]-1)
-        else:
-            bx,by,bz = rmax
-            if bx < 0:
-                bx = self.grid_size[0]-1
-            if by < 0:
-                by = self.grid_size[1]-1
-            if bz < 0:
-                bz = self.grid_size[2]-1
-        
-        return ax <= x <= bx and ay <= y <= by and az <= z <= bz
-        
-    def count_obj(self, obj_name):
-        count = 0
-        gx, gy, gz = self.grid_size
-        for x in range(gx):
-            for y in range(gy):
-                for z in range(gz):
-                    if obj_name in self.grid[x, y, z] and self.collapsed[x,y,z]:
-                        count+=1
-        
-        return count
+    def count_obj(self, tile):
+        """Number of collapsed cells with the tile (maintained by the grid)"""
+        return int(self.tile_counts[tile])
 
     def count_neighbors(self, x, y, z, neighbor, dirs):
         """count neighbors"""
+        if self.neighbor_counts is not None:
+            families = [ i for i, f in enumerate(NEIGHBOR_FAMILIES) if f.keys() <= dirs.keys() ]
+            if sum(len(NEIGHBOR_FAMILIES[i]) for i in families) == len(dirs):
+                column = len(self.tiles) if neighbor is None else neighbor
+                return int(self.neighbor_counts[families, self.index(x, y, z), column].sum())
         count = 0
         for direction, (dx, dy, dz) in dirs.items():
             nx,ny,nz = x+dx, y+dy, z+dz 
             if not self.within_boundaries(nx,ny,nz):
                 continue
-            if (neighbor is None and len(self.grid[nx,ny,nz])>0) or neighbor in self.grid[nx,ny,nz]:
+            if (neighbor is None and self.domains[nx,ny,nz].any()) or (neighbor is not None and self.domains[nx,ny,nz,neighbor]):
                 count+=1
         return count
 
+    def _axis_line(self, x, y, z, axis):
+        """Returns the index of the grid line through (x,y,z) in a given axis"""
+        return tuple(slice(None) if a else p for p, a in zip((x, y, z), axis))
+
+    def _line_key(self, x, y, z, i):
+        """Returns the index of the grid line through (x,y,z) along axis i in line_counts[i]"""
+        return tuple(p for a, p in enumerate((x, y, z)) if a != i)
+
+    def _line_cells(self, x, y, z, axis):
+        """Returns the linear cell indices of the grid line through (x,y,z) in a given axis"""
+        return np.ravel_multi_index(np.broadcast_arrays(*(np.arange(s) if a else p for p, a, s in zip((x, y, z), axis, self.grid_size))), self.grid_size)
+
     def count_axis_neighbors(self, x, y, z, neighbor, axis):
         """Count objects in a given axis"""
-        count = [0,0,0]
-        xa,ya,za = (1-axis[0]) * x, (1-axis[1]) * y, (1-axis[2]) * z
-        while self.within_boundaries(xa, ya, za):
-            if xa!=x or ya!=y or za!=z:
-                if (neighbor is None and len(self.grid[xa,ya,za])>0) or neighbor in self.grid[xa,ya,za]:
-                    count[0]+=axis[0]
-                    count[1]+=axis[1]
-                    count[2]+=axis[2]
-            xa,ya,za = xa+axis[0], ya+axis[1], za+axis[2]
-        return count
+        if self.line_counts is not None:
+            i = axis.index(1)
+            column = len(self.tiles) if neighbor is None else neighbor
+            own = self.domains[x, y, z].any() if neighbor is None else self.domains[x, y, z, neighbor]
+            n = int(self.line_counts[i][self._line_key(x, y, z, i)][column]) - int(own)
+            return [n * a for a in axis]
+        line = self.domains[self._axis_line(x, y, z, axis)]
+        if neighbor is None:
+            found = line.any(axis=1)
+        else:
+            found = line[:, neighbor].copy()
+        found[(x, y, z)[axis.index(1)]] = False
+        n = int(np.count_nonzero(found))
+        return [n * a for a in axis]
     
     def remove_neighbors(self, x, y, z, neighbor, dir):
         """Remove neighbors"""
@@ -194,28 +523,30 @@ class WFC3DGrid:
             nx,ny,nz = x+dx, y+dy, z+dz 
             if not self.within_boundaries(nx,ny,nz):
                 continue
-            if neighbor in self.grid[nx,ny,nz]:
-                self.grid[nx,ny,nz] = [ n for n in self.grid[nx,ny,nz] if n!=neighbor]
+            if self.domains[nx,ny,nz,neighbor]:
+                self.ban(nx,ny,nz,neighbor)
                 reduced_cells.append((nx,ny,nz))
         return reduced_cells
     
     def remove_axis_neighbors(self, x, y, z, neighbor, axis):
         """Remove neighbors"""
-        reduced_cells=[]
-        xa,ya,za = (1-axis[0])*x, (1-axis[1])*y, (1-axis[2])*z
-        while self.within_boundaries(xa, ya, za):
-            if (xa!=x or ya!=y or za!=z) and neighbor in self.grid[xa,ya,za]:
-                self.grid[xa,ya,za] = [ n for n in self.grid[xa,ya,za] if n!=neighbor]
-                reduced_cells.append((xa,ya,za))
-            xa,ya,za = xa+axis[0], ya+axis[1], za+axis[2]
-        return reduced_cells
-    def remove_max_neighbors(self, x, y, z, max_count, dir):
-        """Remove max any random neighbor"""
+        line = self._line_cells(x, y, z, axis)
+        reduced = line[self.cells[line, neighbor]]
+        reduced = reduced[reduced != self.index(x, y, z)]
+        if reduced.size == 0:
+            return []
+        options = self.cells[reduced]
+        options[:, neighbor] = False
+        self.set_cells_options(reduced, options)
+        return [ self.coords(idx) for idx in reduced.tolist() ]
+
+    def remove_max_neighbors(self, x, y, z, max_count, dir, random):
+        """Remove max any random neighbor (in an order drawn from the WFC3DRandom for the cell)"""
         neighbors_pos = []
         ## collect neighbors
         for direction, (dx, dy, dz) in dir.items():
             nx,ny,nz = x+dx, y+dy, z+dz
-            if not self.within_boundaries(nx, ny, nz) or len(self.grid[nx,ny,nz])<1:
+            if not self.within_boundaries(nx, ny, nz) or self.is_empty(nx,ny,nz):
                 continue
             neighbors_pos.append([nx,ny,nz])
         
@@ -223,56 +554,81 @@ class WFC3DGrid:
             max_count = len(neighbors_pos)
 
         ## randomize neighbor positions and remove first max_count neighbors
-        random.shuffle(neighbors_pos)
+        keys = [ self.world_index(*pos) for pos in neighbors_pos ]
+        neighbors_pos = [ neighbors_pos[i] for i in random.permutation(PRUNE, self.world_index(x, y, z), keys).tolist() ]
         for i in range(max_count):
             dx,dy,dz = neighbors_pos[i]
-            self.grid[dx,dy,dz] = []
+            self.clear(dx,dy,dz)
         return []
-    def remove_max_axis_neighbors(self, x, y, z, max_count, axis):
-        """Remove max any random axis neighbor"""
-        neighbor_pos = []
-        xa,ya,za = (1-axis[0])*x, (1-axis[1])*y, (1-axis[2])*z
-        while self.within_boundaries(xa, ya, za):
-            if ((xa!=x or ya!=y or za!=z)or(max_count==0)) and len(self.grid[xa,ya,za])>0:
-                neighbor_pos.append([xa,ya,za])   
-            xa,ya,za = xa+axis[0], ya+axis[1], za+axis[2]
+    def remove_max_axis_neighbors(self, x, y, z, max_count, axis, random):
+        """Remove max any random axis neighbor (in an order drawn from the WFC3DRandom for the cell)"""
+        line = self._line_cells(x, y, z, axis)
+        found = self.cells[line].any(axis=1)
+        if max_count != 0:
+            found &= line != self.index(x, y, z)
+        order = random.permutation(PRUNE, self.world_index(x, y, z), self.world_index(*self.coords(line[found])))
+        neighbor_pos = [ list(self.coords(idx)) for idx in line[found][order].tolist() ]
         
         if max_count > len(neighbor_pos):
             max_count = len(neighbor_pos)
-        random.shuffle(neighbor_pos)
         for i in range(max_count):
             xa,ya,za = neighbor_pos[i]
-            self.grid[xa,ya,za] = []
+            self.clear(xa,ya,za)
         return []
     
-    def remove_obj(self, obj_name, pos, dir):
-        gx, gy, gz = self.grid_size
+    def remove_obj(self, tile, pos, dir):
         reduced_cells = []
         if pos and dir:
             x,y,z = pos
             dx, dy, dz = dir
             if self.within_boundaries(x+dx, y+dy, z+dz):
-                obj_list = self.grid[x+dx,y+dy,z+dz]
-                if obj_name in obj_list and not self.collapsed[x, y, z]:
-                    self.grid[x+dx,y+dy,z+dz] = [n for n in obj_list if n != obj_name]
+                if self.domains[x+dx,y+dy,z+dz,tile] and not self.collapsed[x, y, z]:
+                    self.ban(x+dx,y+dy,z+dz,tile)
                     reduced_cells.append((x+dx,y+dy,z+dz))
         else:
-            for x in range(gx):
-                for y in range(gy):
-                    for z in range(gz):
-                        obj_list = self.grid[x, y, z]
-                        if obj_name in obj_list and not self.collapsed[x,y,z]:
-                            self.grid[x, y, z] = [n for n in obj_list if n != obj_name]
-                            reduced_cells.append((x,y,z))
+            if tile in self.tile_cells:
+                reduced = np.array(sorted(self.tile_cells[tile]), dtype=np.int64)
+            else:
+                reduced = np.flatnonzero(self.cells[:, tile] & ~self.collapsed.reshape(-1))
+            options = self.cells[reduced]
+            options[:, tile] = False
+            self.set_cells_options(reduced, options)
+            reduced_cells = [ self.coords(idx) for idx in reduced.tolist() ]
         return reduced_cells
     def mark_collapsed(self, x, y, z):
+        idx = self.index(x, y, z)
+        self._save(idx)
+        if not self.collapsed[x,y,z]:
+            self.tile_counts += self.domains[x,y,z]
+            if self.tile_cells:
+                for tile in np.flatnonzero(self.domains[x,y,z] & self.tracked).tolist():
+                    self.tile_cells[tile].discard(idx)
         self.collapsed[x,y,z] = True
     
+    def fix_cells(self, idx, tiles):
+        """Excludes cells from solving: a tile id >= 0 pins the tile, -1 pins an empty cell and
+        a value < -1 keeps the current domain (idx: array of linear cell indices)"""
+        pin = tiles >= -1
+        options = np.zeros((int(pin.sum()), len(self.tiles)), dtype=bool)
+        options[tiles[pin] >= 0, tiles[pin][tiles[pin] >= 0]] = True
+        self.set_cells_options(idx[pin], options)
+        self.mark_cells_collapsed(idx)
+
+    def mark_cells_collapsed(self, idx):
+        """Marks many cells as collapsed (idx: array of linear cell indices)"""
+        self._save(idx)
+        collapsed = self.collapsed.reshape(-1)
+        idx = idx[~collapsed[idx]]
+        self.tile_counts += self.cells[idx].sum(axis=0)
+        if self.tile_cells:
+            self._update_tile_cells(idx, self.cells[idx], np.zeros_like(self.cells[idx]))
+        collapsed[idx] = True
+
     def _mult_vector(self, v1, v2):
         return tuple(a * b for a, b in zip(v1,v2))
     
     def _init_corners(self):
-        gs = (self.grid_size[0]-1, self.grid_size[1]-1, self.grid_size[2]-1)
+        gs = (self.world_size[0]-1, self.world_size[1]-1, self.world_size[2]-1)
         self.corners = {
             'fbl' : (0,0,0),
             'fbr' : self._mult_vector((1,0,0), gs),
@@ -0,0 +1,83 @@
+import bpy
+import numpy as np
+
+# point attributes of the instanced placement
+INSTANCE_ATTRIBUTE = "wfc_instance"
+TILE_ATTRIBUTE = "wfc_tile"
+ROTATION_ATTRIBUTE = "wfc_rotation"
+SCALE_ATTRIBUTE = "wfc_scale"
+
+def create_point_mesh(name, positions, int_attributes, vector_attributes):
+    """Creates a mesh with one vertex per position, all attributes are written at once with foreach_set"""
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(positions))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(positions, dtype=np.float32).ravel())
+    for attr_name, values in int_attributes.items():
+        mesh.attributes.new(attr_name, 'INT', 'POINT').data.foreach_set("value", np.ascontiguousarray(values, dtype=np.int32))
+    for attr_name, values in vector_attributes.items():
+        mesh.attributes.new(attr_name, 'FLOAT_VECTOR', 'POINT').data.foreach_set("vector", np.ascontiguousarray(values, dtype=np.float32).ravel())
+    mesh.update()
+    return mesh
+
+def _named_attribute(nodes, attr_name, data_type):
+    node = nodes.new('GeometryNodeInputNamedAttribute')
+    node.data_type = data_type
+    node.inputs['Name'].default_value = attr_name
+    return node
+
+def instance_node_group(name, sources):
+    """Creates a Geometry Nodes group that instances sources[i] on the points with wfc_instance == i.
+
+    There is one Object Info and one Instance on Points node per source object (selected by
+    comparing the instance attribute), so the node tree grows with the number of unique tiles,
+    not with the number of cells. Rotation (euler) and scale come from point attributes.
+    """
+    group = bpy.data.node_groups.new(name, 'GeometryNodeTree')
+    group.interface.new_socket(name="Geometry", in_out='INPUT', socket_type='NodeSocketGeometry')
+    group.interface.new_socket(name="Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+    nodes, links = group.nodes, group.links
+
+    group_input = nodes.new('NodeGroupInput')
+    group_output = nodes.new('NodeGroupOutput')
+    join = nodes.new('GeometryNodeJoinGeometry')
+    instance = _named_attribute(nodes, INSTANCE_ATTRIBUTE, 'INT')
+    rotation = _named_attribute(nodes, ROTATION_ATTRIBUTE, 'FLOAT_VECTOR')
+    scale = _named_attribute(nodes, SCALE_ATTRIBUTE, 'FLOAT_VECTOR')
+    group_input.location = (-800, 0)
+    for i, node in enumerate([ instance, rotation, scale ]):
+        node.location = (-800, -150 - 150 * i)
+    join.location = (400, 0)
+    group_output.location = (600, 0)
+
+    for i, obj in enumerate(sources):
+        info = nodes.new('GeometryNodeObjectInfo')
+        info.inputs['Object'].default_value = obj
+        info.inputs['As Instance'].default_value = True
+        info.location = (-400, -250 * i)
+        compare = nodes.new('FunctionNodeCompare')
+        compare.data_type = 'INT'
+        compare.operation = 'EQUAL'
+        # integer A and B inputs
+        compare.inputs[3].default_value = i
+        compare.location = (-400, -250 * i - 120)
+        on_points = nodes.new('GeometryNodeInstanceOnPoints')
+        on_points.location = (0, -250 * i)
+        links.new(instance.outputs['Attribute'], compare.inputs[2])
+        links.new(group_input.outputs['Geometry'], on_points.inputs['Points'])
+        links.new(compare.outputs['Result'], on_points.inputs['Selection'])
+        links.new(info.outputs['Geometry'], on_points.inputs['Instance'])
+        links.new(rotation.outputs['Attribute'], on_points.inputs['Rotation'])
+        links.new(scale.outputs['Attribute'], on_points.inputs['Scale'])
+        links.new(on_points.outputs['Instances'], join.inputs['Geometry'])
+    links.new(join.outputs['Geometry'], group_output.inputs['Geometry'])
+    return group
+
+def create_instancer(name, collection, positions, tiles, instances, rotations, scales, sources):
+    """Links an object with the point mesh and the instancing Geometry Nodes modifier to a collection"""
+    mesh = create_point_mesh(name, positions, { TILE_ATTRIBUTE: tiles, INSTANCE_ATTRIBUTE: instances },
+                             { ROTATION_ATTRIBUTE: rotations, SCALE_ATTRIBUTE: scales })
+    obj = bpy.data.objects.new(name, mesh)
+    modifier = obj.modifiers.new(name="WFC 3D Instances", type='NODES')
+    modifier.node_group = instance_node_group(name, sources)
+    collection.objects.link(obj)
+    return obj
@@ -0,0 +1,48 @@
+import bpy
+
+from .constants import *
+
+def source_object(obj):
+    """Returns the object holding the constraints of a tile (first object of a collection)"""
+    if obj.name in bpy.data.collections:
+        objects = bpy.data.collections[obj.name].objects
+        return objects[0] if len(objects) > 0 else None
+    return obj
+
+def _value(v):
+    return tuple(v) if hasattr(v, '__len__') and not isinstance(v, str) else v
+
+def load_ruleset(objects):
+    """Loads the constraints of the tiles from custom properties into a plain ruleset:
+    a dict tile name => { constraint: value } in tile id order (see WFC3DConstraints.compile)"""
+    ruleset = {}
+    for obj in objects:
+        constraints = ruleset[obj.name] = {}
+        obj = source_object(obj)
+        if obj is None:
+            # an empty collection has no neighbors
+            constraints.update({ direction: [] for direction in DIRECTIONS })
+            continue
+
+        # load probability, frequency, transformation, symmetry constraints
+        for p in PROBABILITY_CONSTRAINTS + FREQUENCY_CONSTRAINTS + TRANSFORMATION_CONSTRAINTS + SYMMETRY_CONSTRAINTS + REGION_CONSTRAINTS:
+            cp = "wfc_"+p
+            if cp in obj and obj[cp] != "":
+                constraints[p] = _value(obj[cp])
+            else:
+                constraints[p] = None
+
+        # load grid constraints
+        for c in GRID_CONSTRAINTS:
+            cp = "wfc_"+c
+            if cp in obj and obj[cp] != "":
+                constraints[c] = obj[cp].split(",")
+
+        # load neighbor constraints (None: all objects)
+        for direction in DIRECTIONS:
+            prop_name = f"wfc_{direction.lower()}"
+            if prop_name in obj and obj[prop_name] != "":
+                constraints[direction] = obj[prop_name].split(',')
+            else:
+                constraints[direction] = None
+    return ruleset
@@ -0,0 +1,91 @@
+import numpy as np
+
+from .constants import *
+
+# per tile scalar constraints: name => (value for unset constraints, dtype)
+SCALAR_CONSTRAINTS = {
+    'weight' : (1, float), 'probability' : (1, float), 'freq_grid' : (-1, np.int32),
+    'freq_neighbor' : (-1, np.int32), 'freq_neighbor_face' : (-1, np.int32), 'freq_neighbor_corner' : (-1, np.int32), 'freq_neighbor_edge' : (-1, np.int32),
+    'freq_any_neighbor' : (-1, np.int32), 'freq_any_neighbor_face' : (-1, np.int32), 'freq_any_neighbor_corner' : (-1, np.int32), 'freq_any_neighbor_edge' : (-1, np.int32),
+    'scale_type' : (0, np.int32), 'sym_rotate_n' : (-1, np.int32),
+}
+# per tile vector constraints (3 values)
+VECTOR_CONSTRAINTS = {
+    'freq_axes' : (-1, np.int32), 'freq_any_axes' : (-1, np.int32),
+    'region_min' : (-1, np.int32), 'region_max' : (-1, np.int32),
+    'sym_mirror_axes' : (False, bool), 'sym_rotate_axis' : (0, float),
+    'translation_min' : (0, float), 'translation_max' : (0, float), 'translation_steps' : (0, float),
+    'rotation_min' : (0, float), 'rotation_max' : (0, float), 'rotation_steps' : (0, float),
+    'scale_min' : (1, float), 'scale_max' : (1, float), 'scale_steps' : (0, float), 'scale_uni' : (0, float),
+}
+# constraints that are only applied if all of them are set
+TRANSFORMATION_GROUPS = {
+    'translation' : ['translation_min', 'translation_max', 'translation_steps'],
+    'rotation' : ['rotation_min', 'rotation_max', 'rotation_steps'],
+    'scale' : ['scale_min', 'scale_max', 'scale_steps'],
+    'scale_uni' : ['scale_uni'],
+}
+# neighbor frequency constraints and their directions (columns of neighbor_limits and any_neighbor_limits)
+NEIGHBOR_FREQUENCIES = [ 'freq_neighbor_face', 'freq_neighbor_corner', 'freq_neighbor_edge', 'freq_neighbor' ]
+ANY_NEIGHBOR_FREQUENCIES = [ 'freq_any_neighbor_face', 'freq_any_neighbor_corner', 'freq_any_neighbor_edge', 'freq_any_neighbor' ]
+NEIGHBOR_FREQUENCY_DIRECTIONS = [ FACE_DIRECTIONS, CORNER_DIRECTIONS, EDGE_DIRECTIONS, DIRECTIONS ]
+
+
+class WFC3DModel:
+    """Compiled, immutable constraints of a tile set.
+
+    Tiles are integer ids (index into tiles). Each scalar or vector constraint is a numpy
+    array indexed by the tile id (unset constraints hold the neutral value, see
+    SCALAR_CONSTRAINTS and VECTOR_CONSTRAINTS), compat holds the compatibility matrix of
+    each direction and active tells which constraint families are used by any tile.
+    """
+    def __init__(self, tiles, compat, values, is_set, grid_constraints):
+        self.tiles = tuple(tiles)
+        self.tile_ids = { name: tile for tile, name in enumerate(self.tiles) }
+        self.compat = np.array(compat, dtype=bool)
+        for name, (default, dtype) in { **SCALAR_CONSTRAINTS, **VECTOR_CONSTRAINTS }.items():
+            setattr(self, name, np.asarray(values[name], dtype=dtype))
+        self.grid_constraints = tuple(grid_constraints)
+        # transformation groups and scale_uni are only applied if set
+        self.transformations = { group: np.all([ is_set[n] for n in names ], axis=0) for group, names in TRANSFORMATION_GROUPS.items() }
+
+        # symmetry needs a mirror axis or a rotation axis with more than one rotation
+        rotate = is_set['sym_rotate_axis'] & (self.sym_rotate_n > 1)
+        self.sym_rotate_n = np.where(rotate, self.sym_rotate_n, 1).astype(np.int32)
+        self.symmetry = self.sym_mirror_axes.any(axis=1) | rotate
+        self.neighbor_limits = np.stack([ getattr(self, name) for name in NEIGHBOR_FREQUENCIES ], axis=1).reshape(-1, len(NEIGHBOR_FREQUENCIES))
+        self.any_neighbor_limits = np.stack([ getattr(self, name) for name in ANY_NEIGHBOR_FREQUENCIES ], axis=1).reshape(-1, len(ANY_NEIGHBOR_FREQUENCIES))
+        self.frequency = (self.freq_grid > -1) | (self.neighbor_limits > -1).any(axis=1) | (self.any_neighbor_limits > -1).any(axis=1) \
+                         | (self.freq_axes > -1).any(axis=1) | (self.freq_any_axes > -1).any(axis=1)
+        t = self.transformations
+        self.active = {
+            'freq_grid' : bool((self.freq_grid > -1).any()),
+            'freq_neighbor' : bool((self.neighbor_limits > -1).any()),
+            'freq_any_neighbor' : bool((self.any_neighbor_limits > -1).any()),
+            'freq_axes' : bool((self.freq_axes > -1).any()),
+            'freq_any_axes' : bool((self.freq_any_axes > -1).any()),
+            'probability' : bool((self.probability < 1).any() or (self.weight != 1).any()),
+            'symmetry' : bool(self.symmetry.any()),
+            'transformation' : bool((t['translation'] | t['rotation'] | ((self.scale_type == 1) & t['scale_uni']) | ((self.scale_type == 2) & t['scale'])).any()),
+        }
+        for value in [ *vars(self).values(), *self.transformations.values() ]:
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("WFC3DModel is immutable")
+        super().__setattr__(name, value)
+
+    @property
+    def n_tiles(self):
+        return len(self.tiles)
+
+    def tile_weights(self):
+        """Returns the weight of each tile scaled by its probability (used for the weighted entropy)"""
+        return self.weight * np.where(self.probability < 1, self.probability, 1)
+
+    def grid_frequency_tiles(self):
+        """Returns the tile ids with a grid frequency constraint"""
+        return np.flatnonzero(self.freq_grid > -1).tolist()
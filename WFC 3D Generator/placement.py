@@ -0,0 +1,84 @@
+import bpy
+
+def modifier_recipe(obj):
+    """Reads the modifiers of an object once: a list of (name, type, [ (attribute, value) ]) of the writable properties"""
+    recipe = []
+    for mod in obj.modifiers:
+        values = [ (p.identifier, getattr(mod, p.identifier)) for p in mod.bl_rna.properties
+                   if not p.is_readonly and p.identifier not in ('rna_type', 'name', 'type') ]
+        recipe.append((mod.name, mod.type, values))
+    return recipe
+
+
+class WFC3DTileVariant:
+    """A source object of a tile with its shared data, modifier recipe and the rotation and scale
+    of its new objects (copies keep the ones of the source object)"""
+    def __init__(self, obj, link_objects, copy_modifiers):
+        self.obj = obj
+        self.link_objects = link_objects
+        self.rotation_euler = (0.0, 0.0, 0.0) if link_objects else tuple(obj.rotation_euler)
+        self.scale = (1.0, 1.0, 1.0) if link_objects else tuple(obj.scale)
+        # copied objects of a tile share one copy of the data, made by the first stamp
+        self.data = obj.data if link_objects else None
+        self.recipe = modifier_recipe(obj) if link_objects and copy_modifiers else []
+        self.checked = False
+
+    def _copy_modifiers(self, new_obj):
+        for (name, type, values) in self.recipe:
+            new_mod = new_obj.modifiers.new(name=name, type=type)
+            if self.checked:
+                for attr, value in values:
+                    setattr(new_mod, attr, value)
+                continue
+            # the first copy drops the attributes that cannot be set from the recipe
+            for attr, value in list(values):
+                try:
+                    setattr(new_mod, attr, value)
+                except Exception:
+                    values.remove((attr, value))
+        self.checked = True
+
+    def stamp(self):
+        """Creates a new object of the variant"""
+        if self.link_objects:
+            new_obj = bpy.data.objects.new(name=self.obj.name, object_data=self.data)
+            self._copy_modifiers(new_obj)
+        else:
+            new_obj = self.obj.copy()
+            if self.obj.data is not None:
+                if self.data is None:
+                    self.data = self.obj.data.copy()
+                new_obj.data = self.data
+        return new_obj
+
+    def retarget(self, obj):
+        """Turns a placed object of another tile into an object of the variant if only its data
+        differs (linked objects without modifiers), returns False otherwise"""
+        if not self.link_objects or self.recipe or len(obj.modifiers) > 0 or obj.type != self.obj.type:
+            return False
+        obj.data = self.data
+        obj.name = self.obj.name
+        return True
+
+
+class WFC3DTileTemplate:
+    """Everything to place a tile, prepared once before the placement loop: the tile object or
+    the objects of a tile collection (one is chosen randomly per cell) as WFC3DTileVariant"""
+    def __init__(self, obj, link_objects, copy_modifiers):
+        self.is_collection = obj.name in bpy.data.collections
+        sources = list(bpy.data.collections[obj.name].objects) if self.is_collection else [ obj ]
+        self.variants = [ WFC3DTileVariant(src, link_objects, copy_modifiers) for src in sources ]
+        self.names = { variant.obj.name: variant for variant in self.variants }
+
+    def choose(self, u):
+        """Returns the variant of a cell (the variant of a tile collection chosen by the uniform number u)"""
+        return self.variants[min(int(u * len(self.variants)), len(self.variants) - 1)]
+
+    def variant(self, name):
+        """Returns the variant of a source object name or None if it is not one of the tile"""
+        return self.names.get(name)
+
+
+def create_templates(objects, link_objects, copy_modifiers):
+    """Returns the templates of the tiles (indexed by tile id)"""
+    return [ WFC3DTileTemplate(obj, link_objects, copy_modifiers) for obj in objects ]
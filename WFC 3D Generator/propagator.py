@@ -0,0 +1,152 @@
+import numpy as np
+
+from .constants import DIRECTIONS, OPPOSITE_DIRECTIONS
+from .grid import NEIGHBOR_FAMILIES, DIRECTION_FAMILY
+
+# upper bound for the AC-4 support counters, larger problems use WFC3DBatchPropagator
+MAX_SUPPORT_BYTES = 512 * 1024 * 1024
+
+DIRECTION_NAMES = list(DIRECTIONS)
+OPPOSITE_INDEX = [ DIRECTION_NAMES.index(OPPOSITE_DIRECTIONS[d]) for d in DIRECTION_NAMES ]
+
+
+def support_dtype(n_tiles):
+    return np.uint8 if n_tiles < 255 else np.uint16 if n_tiles < 65535 else np.uint32
+
+
+def support_bytes(grid_size, n_tiles):
+    return int(np.prod(grid_size)) * len(DIRECTIONS) * n_tiles * np.dtype(support_dtype(n_tiles)).itemsize
+
+
+class WFC3DSupportPropagator:
+    """AC-4 propagation with support counters.
+
+    supports[cell, direction, tile] counts the tiles of the neighbor cell in direction
+    that are compatible with tile. Removing tiles from a cell only decrements the counters
+    of its neighbors; a tile is removed from a neighbor when its counter drops to zero.
+    Empty cells (holes) do not restrict their neighbors, collapsed cells are never reduced.
+    pops and removals (tiles per direction family) count the work done.
+    """
+    def __init__(self, grid, compat):
+        self.grid = grid
+        self.compat = np.array(compat)
+        self.opposite = np.array(OPPOSITE_INDEX)
+        self.pops = 0
+        self.removals = np.zeros(len(NEIGHBOR_FAMILIES), dtype=np.int64)
+        cells = grid.cells
+        neighbors = grid.neighbors
+        self.supports = np.ones((cells.shape[0], len(DIRECTIONS), cells.shape[1]), dtype=support_dtype(cells.shape[1]))
+        # few distinct domains exist after initialization => count supports per distinct domain
+        domains, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        for k in range(len(DIRECTIONS)):
+            counts = domains.astype(np.float32) @ compat[k].T.astype(np.float32)
+            counts[~domains.any(axis=1)] = 1
+            inside = neighbors[:, k] >= 0
+            self.supports[inside, k] = counts[inverse[neighbors[inside, k]]]
+        self.seen = cells.copy()
+
+        # remove all unsupported tiles of the initial domains
+        unsupported = (cells & (self.supports == 0).any(axis=1)) & ~grid.collapsed.reshape(-1, 1)
+        for idx in np.flatnonzero(unsupported.any(axis=1)).tolist():
+            grid.set_cell_options(idx, cells[idx] & ~unsupported[idx])
+
+    def nbytes(self):
+        return self.supports.nbytes + self.seen.nbytes
+
+    def restore(self, restored):
+        """Recomputes the counters around cells restored by backtracking"""
+        cells = self.grid.cells
+        neighbors = self.grid.neighbors
+        for idx in restored.tolist():
+            self.seen[idx] = cells[idx]
+            inside = neighbors[idx] >= 0
+            m = neighbors[idx][inside]
+            e = self.opposite[inside]
+            if cells[idx].any():
+                self.supports[m, e] = self.compat[np.ix_(inside, cells[idx])].sum(axis=1, dtype=self.supports.dtype)
+            else:
+                self.supports[m, e] = 1
+
+    def propagate(self):
+        grid = self.grid
+        cells = grid.cells
+        collapsed = grid.collapsed.reshape(-1)
+        neighbors = grid.neighbors
+        while grid.dirty:
+            idx = grid.dirty.popleft()
+            self.pops += 1
+            removed = self.seen[idx] & ~cells[idx]
+            if not removed.any():
+                continue
+            self.seen[idx] = cells[idx]
+            inside = neighbors[idx] >= 0
+            m = neighbors[idx][inside]
+            e = self.opposite[inside]
+            if not cells[idx].any():
+                self.supports[m, e] = 1
+                continue
+            self.supports[m, e] -= self.compat[np.ix_(inside, removed)].sum(axis=1, dtype=self.supports.dtype)
+            unsupported = cells[m] & (self.supports[m, e] == 0) & ~collapsed[m, np.newaxis]
+            rows = np.flatnonzero(unsupported.any(axis=1))
+            if rows.size:
+                self.removals += np.bincount(DIRECTION_FAMILY[inside][rows], unsupported[rows].sum(axis=1), len(NEIGHBOR_FAMILIES)).astype(np.int64)
+            for i in rows.tolist():
+                grid.set_cell_options(m[i], cells[m[i]] & ~unsupported[i])
+
+
+class WFC3DBatchPropagator:
+    """Wave propagation over the whole frontier of changed cells.
+
+    Each wave restricts the neighbors of all changed cells at once, one direction at a time:
+    the union of the tiles compatible with the source domains is a matrix product of the
+    frontier domains with the compatibility matrix. Waves repeat until no cell changes.
+    """
+    def __init__(self, grid, compat):
+        self.grid = grid
+        self.compat = [ c.astype(np.float32) for c in compat ]
+        self.pops = 0
+        self.removals = np.zeros(len(NEIGHBOR_FAMILIES), dtype=np.int64)
+        grid.dirty.extend(range(grid.cells.shape[0]))
+
+    def nbytes(self):
+        return 0
+
+    def restore(self, restored):
+        pass
+
+    def propagate(self):
+        grid = self.grid
+        cells = grid.cells
+        collapsed = grid.collapsed.reshape(-1)
+        neighbors = grid.neighbors
+        while grid.dirty:
+            frontier = np.unique(np.fromiter(grid.dirty, dtype=np.int64, count=len(grid.dirty)))
+            grid.dirty.clear()
+            self.pops += frontier.size
+            # holes do not restrict their neighbors
+            sources = frontier[cells[frontier].any(axis=1)]
+            if sources.size == 0:
+                continue
+            domains = cells[sources].astype(np.float32)
+            for k, compat in enumerate(self.compat):
+                targets = neighbors[sources, k]
+                valid = targets >= 0
+                valid[valid] = ~collapsed[targets[valid]]
+                if not valid.any():
+                    continue
+                targets = targets[valid]
+                restricted = cells[targets] & ((domains[valid] @ compat) > 0)
+                shrunk = (restricted != cells[targets]).any(axis=1)
+                if shrunk.any():
+                    self.removals[DIRECTION_FAMILY[k]] += int(np.count_nonzero(cells[targets[shrunk]] & ~restricted[shrunk]))
+                    grid.set_cells_options(targets[shrunk], restricted[shrunk])
+
+
+PROPAGATORS = { 'AC4' : WFC3DSupportPropagator, 'BATCH' : WFC3DBatchPropagator }
+
+def create_propagator(grid, compat, mode='AUTO'):
+    """Creates the propagator for mode AC4, BATCH or AUTO (AC4 if the support counters fit into MAX_SUPPORT_BYTES)"""
+    if mode not in PROPAGATORS:
+        mode = 'AC4' if support_bytes(grid.grid_size, len(grid.tiles)) <= MAX_SUPPORT_BYTES else 'BATCH'
+    return PROPAGATORS[mode](grid, compat)
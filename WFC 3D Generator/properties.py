@@ -143,16 +143,47 @@ class WFC3DEditPanelNeighborMultiSelItem(bpy.types.PropertyGroup):
     
 class WFC3DProperties(bpy.types.PropertyGroup):
     collection_obj: bpy.props.PointerProperty(name="", description="Select a collection", type=bpy.types.Collection, update=handle_update_collection)
-    grid_size: bpy.props.IntVectorProperty(name="", description="Size of the 3D grid", size=3, default=(5, 5, 5), min=1, max=100,)
+    grid_size: bpy.props.IntVectorProperty(name="", description="Size of the 3D grid (grids larger than 100x100x100 cells need chunks or streaming)", size=3, default=(5, 5, 5), min=1, soft_max=100, max=100000,)
     spacing: bpy.props.FloatVectorProperty(name="", description="Size of a Grid Cell", subtype="TRANSLATION", default=(2.0,2.0,2.0), min=0.1,) 
     use_constraints: bpy.props.BoolProperty(name="Use Constraints", description="Use constraints", default=True,)
     target_collection: bpy.props.StringProperty(name="", description="Target collection for 3D grid", default="WFC_Generated",)
     random_start_cell: bpy.props.BoolProperty(name="Random Start Cell", description="Random start cell", default=False,)
+    propagation_mode: bpy.props.EnumProperty(name="Propagation", description="Constraint propagation algorithm",
+        items=[("AUTO","Automatic","Support counters if they fit into memory, batched propagation otherwise"),
+               ("AC4","Support Counters","AC-4 propagation with support counters (fast, needs memory per cell, direction and object)"),
+               ("BATCH","Batched","Propagate all changed cells at once with array operations (for large grids)"),],
+        default="AUTO",
+    )
+    entropy_mode: bpy.props.EnumProperty(name="Entropy", description="Heuristic to choose the next cell",
+        items=[("COUNT","Count","Cell with the fewest possible objects"),
+               ("SHANNON","Weighted","Cell with the lowest Shannon entropy of the object weights"),],
+        default="COUNT",
+    )
+    use_backtracking: bpy.props.BoolProperty(name="Backtracking", description="Undo the last decisions on a contradiction instead of leaving empty cells", default=False,)
+    max_backtracks: bpy.props.IntProperty(name="Max Backtracks", description="Maximum number of undone decisions", default=1000, min=1,)
+    use_chunks: bpy.props.BoolProperty(name="Chunks", description="Solve the grid chunk by chunk (for large grids)", default=False,)
+    chunk_size: bpy.props.IntVectorProperty(name="", description="Size of a chunk", size=3, default=(16, 16, 16), min=2, max=256,)
+    use_streaming: bpy.props.BoolProperty(name="Streaming", description="Solve the grid window by window along an axis and write the result to a file (for very long grids)", default=False,)
+    stream_axis: bpy.props.EnumProperty(name="Axis", description="Axis to stream along",
+        items=[("X","X","Stream along the X axis"), ("Y","Y","Stream along the Y axis"), ("Z","Z","Stream along the Z axis"),],
+        default="X",
+    )
+    stream_window: bpy.props.IntProperty(name="Window", description="Number of slices solved at once", default=8, min=1,)
+    stream_file: bpy.props.StringProperty(name="File", description="File for the streamed result (temporary file if empty)", default="", subtype="FILE_PATH",)
     random_direction: bpy.props.BoolProperty(name="Random Direction", description="Random direction", default=False,)
     seed: bpy.props.IntProperty(name="Random Seed", description="Random seed", default=0,)
     link_objects: bpy.props.BoolProperty(name="Link New Objects (recommended)", description="Link new objects instead of copying them.", default=True,)
     copy_modifiers: bpy.props.BoolProperty(name="Copy Modifiers", description="Copy modifiers to linked objects.", default=False,)
+    placement_mode: bpy.props.EnumProperty(name="Placement", description="How the generated model is placed",
+        items=[("OBJECTS","Objects","One object per cell"),
+               ("INSTANCES","Instances","One mesh with a point per cell, the objects are instanced with Geometry Nodes (for large grids)"),],
+        default="OBJECTS",
+    )
     remove_target_collection: bpy.props.BoolProperty(name="Remove Target Collection", description="Remove existing target collection", default=False,)
+    resolve_selection: bpy.props.BoolProperty(name="Selected Objects", description="Regenerate the box around the selected objects of the target collection (or the box of the region cells if nothing is selected)", default=True,)
+    resolve_min: bpy.props.IntVectorProperty(name="Min", description="First cell of the region to regenerate", size=3, default=(0, 0, 0), min=0,)
+    resolve_max: bpy.props.IntVectorProperty(name="Max", description="Last cell of the region to regenerate", size=3, default=(1, 1, 1), min=0,)
+    reuse_objects: bpy.props.BoolProperty(name="Reuse Placed Objects", description="Update the objects of an existing target collection: only cells with another tile get new, removed or retargeted objects", default=False,)
     obj_list: bpy.props.CollectionProperty(type=WFC3DEditPanelMultiSelItem)
     obj_list_idx: bpy.props.IntProperty()
     neighbor_list: bpy.props.CollectionProperty(type=WFC3DEditPanelNeighborMultiSelItem)
@@ -0,0 +1,72 @@
+import numpy as np
+
+# purposes of the random draws (part of the key of each draw)
+COLLAPSE = 1
+TIE_BREAK = 2
+PRUNE = 3
+VARIANT = 4
+TRANSFORM = 5
+# purposes of the solver, a nonce changes their draws (see WFC3DRandom.set_nonce)
+SOLVE_PURPOSES = (COLLAPSE, TIE_BREAK, PRUNE)
+
+MASK = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+
+def _mix(h):
+    """SplitMix64 finalizer of a 64 bit integer"""
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK
+    return h ^ (h >> 31)
+
+def _mix_array(h):
+    """SplitMix64 finalizer of an uint64 array (same bits as _mix)"""
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+class WFC3DRandom:
+    """Counter-based random numbers: each draw is a hash of (seed, purpose, cell, counter).
+
+    A draw does not depend on the draws before it, so cells can be solved and placed in any
+    order, chunk by chunk or vectorized, and still get the same numbers. cell is the linear
+    index of a cell in the world grid, counter numbers the draws of a cell for a purpose.
+    """
+    def __init__(self, seed, nonce=0):
+        self.seed = seed
+        self.key = _mix((seed * GOLDEN) & MASK)
+        self.set_nonce(nonce)
+
+    def set_nonce(self, nonce):
+        """Sets the nonce of the solver draws (SOLVE_PURPOSES): a region solved again with another
+        nonce gets new tiles, the variants and transformations of its cells keep their draws"""
+        self.nonce = nonce
+        self.solve_key = self.key if nonce == 0 else _mix((self.key + int(nonce) * GOLDEN) & MASK)
+
+    def _key(self, purpose):
+        return self.solve_key if purpose in SOLVE_PURPOSES else self.key
+
+    def bits(self, purpose, cell, counter=0):
+        """Returns the 64 random bits of a draw"""
+        h = _mix((self._key(purpose) + int(purpose) * GOLDEN) & MASK)
+        h = _mix((h + int(cell) * GOLDEN) & MASK)
+        return _mix((h + int(counter) * GOLDEN) & MASK)
+
+    def random(self, purpose, cell, counter=0):
+        """Returns a float in [0, 1)"""
+        return (self.bits(purpose, cell, counter) >> 11) * 2.0**-53
+
+    def bits_array(self, purpose, cells, counters=0):
+        """Returns the random bits of the draws of many cells (or counters) as uint64 array"""
+        with np.errstate(over='ignore'):
+            h = np.uint64(_mix((self._key(purpose) + purpose * GOLDEN) & MASK))
+            h = _mix_array(h + np.asarray(cells, dtype=np.int64).astype(np.uint64) * np.uint64(GOLDEN))
+            return _mix_array(h + np.asarray(counters, dtype=np.int64).astype(np.uint64) * np.uint64(GOLDEN))
+
+    def randoms(self, purpose, cells, counters=0):
+        """Returns floats in [0, 1) of many cells (same values as random)"""
+        return (self.bits_array(purpose, cells, counters) >> np.uint64(11)) * 2.0**-53
+
+    def permutation(self, purpose, cell, keys):
+        """Returns a random order of items identified by keys (e.g. their cells), drawn for a cell"""
+        return np.argsort(self.bits_array(purpose, cell, keys), kind='stable')
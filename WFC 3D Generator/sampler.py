@@ -0,0 +1,45 @@
+import numpy as np
+from functools import lru_cache
+
+from .rng import COLLAPSE
+
+class WFC3DSampler:
+    """Draws a tile from a cell domain with the weight and probability constraints.
+
+    Tiles with a probability p < 1 are tried first: for a uniform r one of the tiles with
+    r < p is chosen uniformly. Otherwise a tile without probability constraint is drawn
+    proportionally to its weight. The cumulative weight tables are built once per distinct
+    domain and kept in a LRU cache keyed by the domain bits.
+    """
+    def __init__(self, weights, probabilities, maxsize=4096):
+        self.weights = np.asarray(weights, dtype=float)
+        self.probabilities = np.asarray(probabilities, dtype=float)
+        self.table = lru_cache(maxsize=maxsize)(self._build_table)
+
+    def _build_table(self, key):
+        domain = np.unpackbits(np.frombuffer(key, dtype=np.uint8), count=len(self.weights)).astype(bool)
+        tiles = np.flatnonzero(domain)
+        limited = self.probabilities[tiles] < 1
+        # tiles with probability constraint by descending probability
+        order = np.argsort(-self.probabilities[tiles[limited]], kind='stable')
+        limited_tiles = tiles[limited][order]
+        neg_probabilities = -self.probabilities[limited_tiles]
+        free_tiles = tiles[~limited]
+        weights = self.weights[free_tiles]
+        if weights.sum() <= 0:
+            weights = np.ones(len(free_tiles))
+        return limited_tiles, neg_probabilities, free_tiles, np.cumsum(weights)
+
+    def choice(self, domain, random, cell):
+        """Returns a tile id drawn from a boolean domain vector or -1 if no tile can be chosen
+        (random: the WFC3DRandom, cell: world index of the cell)"""
+        limited_tiles, neg_probabilities, free_tiles, cumulative = self.table(np.packbits(domain).tobytes())
+        if limited_tiles.size:
+            # number of tiles with r < p
+            k = int(np.searchsorted(neg_probabilities, -random.random(COLLAPSE, cell, 0), side='left'))
+            if k:
+                return int(limited_tiles[int(random.random(COLLAPSE, cell, 1) * k)])
+        if free_tiles.size == 0:
+            return -1
+        i = int(np.searchsorted(cumulative, random.random(COLLAPSE, cell, 2) * cumulative[-1], side='right'))
+        return int(free_tiles[min(i, free_tiles.size - 1)])
@@ -0,0 +1,314 @@
+import time
+import numpy as np
+
+from .constraints import WFC3DConstraints
+from .grid import WFC3DGrid
+from .entropy import WFC3DEntropyIndex
+from .chunks import WFC3DChunkStore, WFC3DStreamStore, EMPTY_ID
+from .stats import WFC3DStats
+from .rng import WFC3DRandom, COLLAPSE
+
+# largest grid solved in memory at once (larger grids need chunks or streaming)
+MAX_GRID_CELLS = 100 * 100 * 100
+
+class WFC3DSolver:
+    """Wave Function Collapse solver without Blender dependencies.
+
+    Takes a plain ruleset (dict tile name => constraints, see loader.load_ruleset, tile ids
+    follow the dict order) and solves a grid, chunk by chunk or window by window into tile ids.
+    """
+    def __init__(self, ruleset, grid_size, seed=0, use_constraints=True, propagation_mode='AUTO', entropy_mode='COUNT',
+                 random_start_cell=False, use_backtracking=False, max_backtracks=1000, use_chunks=False, chunk_size=(16, 16, 16),
+                 use_streaming=False, stream_axis=0, stream_window=8, stream_file=""):
+        if not ruleset:
+            raise ValueError("Ruleset is empty!")
+        self.tiles = list(ruleset)
+        self.grid_size = tuple(grid_size)
+        self.use_constraints = use_constraints
+        self.propagation_mode = propagation_mode
+        self.entropy_mode = entropy_mode
+        self.random_start_cell = random_start_cell
+        self.use_backtracking = use_backtracking
+        self.max_backtracks = max_backtracks
+        self.use_chunks = use_chunks
+        self.chunk_size = tuple(chunk_size)
+        self.use_streaming = use_streaming
+        self.stream_axis = stream_axis
+        self.stream_window = stream_window
+        self.stream_file = stream_file
+        self.backtracks = 0
+        self.backtrack_budget = 0
+        self.chunks = None
+        self.decisions = []
+        self.stats = WFC3DStats()
+        # solved cells of stored chunks and the box of the current grid inside its chunk
+        self.solved_cells = 0
+        self.inner = None
+        # world and box of a region re-solve (see region_steps)
+        self.world = None
+        self.region = None
+
+        # every random draw is keyed by (seed, purpose, world cell, counter), see WFC3DRandom
+        self.random = WFC3DRandom(seed)
+        self.constraints = None
+        if self.use_constraints:
+            self.constraints = WFC3DConstraints()
+            self.constraints.initialize_constraints(ruleset)
+            self.constraints.random = self.random
+
+        self.grid = WFC3DGrid(self.grid_size)
+        self.entropy_index = None
+
+    def get_entropy(self, x, y, z):
+        """Calculates the entropy of a cell: number of possible states or the weighted Shannon entropy"""
+        if self.grid.weights is not None:
+            return self.grid.entropy(self.grid.index(x, y, z))
+        return self.grid.count(x, y, z)
+
+    def get_lowest_entropy_cell(self):
+        """Finds the cell with the lowest entropy"""
+        return self.entropy_index.pop_lowest()
+
+    def collapse(self, x, y, z):
+        """Collapses a cell into a single state"""
+        if self.use_constraints:
+            self.constraints.collapse(self.grid, x, y, z)
+        else:
+            options = self.grid.options(x, y, z)
+            self.grid.assign(x, y, z, int(options[int(self.random.random(COLLAPSE, self.grid.world_index(x, y, z)) * len(options))]))
+            self.grid.mark_collapsed(x, y, z)
+
+    def backtrack(self):
+        """Undoes decisions until the grid is free of contradictions or the backtrack budget is used up.
+        The choice of each undone decision is banned in its cell before propagating again."""
+        while self.grid.contradiction and self.decisions and self.backtracks < self.backtrack_budget:
+            self.backtracks += 1
+            (x, y, z), tile = self.decisions.pop()
+            self.constraints.restore(self.grid.pop_level())
+            if tile < 0:
+                continue
+            self.grid.ban(x, y, z, tile)
+            self.constraints.propagator.propagate()
+        # budget exhausted: keep the empty cells
+        self.grid.contradiction = False
+
+    def run(self):
+        """Solves the world grid (in one piece, chunk by chunk or window by window), returns the WFC3DStats"""
+        for _ in self.steps():
+            pass
+        return self.stats
+
+    def steps(self):
+        """Solves the world grid step by step: yields after each observe/propagate step (see progress)"""
+        self.stats = WFC3DStats()
+        self.stats.cells = int(np.prod(self.grid_size))
+        self.solved_cells = 0
+        self.world = None
+        self.region = None
+        self.random.set_nonce(0)
+        start = time.perf_counter()
+        frequency_time = self.constraints.frequency_time if self.use_constraints else 0.0
+        if self.use_streaming:
+            yield from self.generate_chunks(WFC3DStreamStore(self.grid_size, self.stream_axis, self.stream_window, len(self.tiles), self.stream_file))
+            self.chunks.flush()
+        elif self.use_chunks:
+            yield from self.generate_chunks(WFC3DChunkStore(self.grid_size, self.chunk_size, len(self.tiles)))
+        else:
+            if self.stats.cells > MAX_GRID_CELLS:
+                raise ValueError(f"Grid has more than {MAX_GRID_CELLS} cells, use chunks or streaming!")
+            self.inner = (slice(None),) * 3
+            yield from self.solve_steps()
+        self.stats.solve_time = time.perf_counter() - start
+        self.stats.backtracks = self.backtracks
+        if self.use_constraints:
+            self.stats.frequency_time = self.constraints.frequency_time - frequency_time
+
+    def progress(self):
+        """Returns the number of solved cells of the world"""
+        if self.inner is None or self.grid.collapsed is None:
+            return self.solved_cells
+        return self.solved_cells + int(np.count_nonzero(self.grid.collapsed[self.inner]))
+
+    def count_tiles(self):
+        """Returns the number of non-empty cells of the solved world"""
+        if self.region is not None:
+            return int(np.count_nonzero(self.world[self.region] >= 0))
+        if self.chunks is not None:
+            return int(self.chunks.tile_counts.sum())
+        return int(np.count_nonzero(self.grid.result() >= 0))
+
+    def result(self):
+        """Returns the tile ids of the solved world (int64, -1 for empty cells) in memory, also
+        for chunked and streamed worlds"""
+        if self.world is not None:
+            return self.world
+        if isinstance(self.chunks, WFC3DStreamStore):
+            volume = np.asarray(self.chunks.volume).astype(np.int64)
+            return np.where(volume == EMPTY_ID, -1, volume)
+        if self.chunks is not None:
+            return self.chunks.get((0, 0, 0), self.grid_size).astype(np.int64)
+        return self.grid.result()
+
+    def generate_chunks(self, store):
+        """Solves the grid chunk by chunk (or window by window), yields after each step. Each chunk is solved
+        with a halo of one cell: cells of solved chunks are pinned (seams in all 26 directions), the others are frozen"""
+        self.chunks = store
+        world = self.chunks.world_size
+        for key in self.chunks.keys():
+            origin, shape = self.chunks.box(key)
+            lo = [ max(o - 1, 0) for o in origin ]
+            hi = [ min(o + s + 1, w) for o, s, w in zip(origin, shape, world) ]
+            self.grid = WFC3DGrid([ h - l for l, h in zip(lo, hi) ], lo, world)
+            inner = tuple(slice(o - l, o - l + s) for o, l, s in zip(origin, lo, shape))
+            halo = np.ones(self.grid.grid_size, dtype=bool)
+            halo[inner] = False
+            tiles = self.chunks.get(lo, self.grid.grid_size)
+            self.inner = inner
+            yield from self.solve_steps((np.flatnonzero(halo), tiles[halo]), self.chunks.tile_counts, self.chunks.line_offsets())
+            self.chunks.store(key, self.grid.result()[inner])
+            self.inner = None
+            self.solved_cells += int(np.prod(shape))
+            self.stats.chunks += 1
+
+    def region_steps(self, world, box_min, box_max, nonce=1):
+        """Re-solves the box [box_min, box_max) of a solved world (tile ids, -1 for empty cells) step by
+        step like a chunk: the cells around the box are pinned and the tiles outside of the box count
+        for the frequency constraints. The new tiles are spliced into a copy of the world (see result).
+        The nonce changes the solver draws, so a box solved again with the seed of the world differs"""
+        world = np.asarray(world)
+        box_min = [ max(b, 0) for b in box_min ]
+        box_max = [ min(b, w) for b, w in zip(box_max, self.grid_size) ]
+        if any(h <= l for l, h in zip(box_min, box_max)):
+            raise ValueError("Region is empty!")
+        region = tuple(slice(l, h) for l, h in zip(box_min, box_max))
+        self.stats = WFC3DStats()
+        self.stats.cells = int(np.prod([ h - l for l, h in zip(box_min, box_max) ]))
+        self.solved_cells = 0
+        self.chunks = None
+        self.world = None
+        self.region = None
+        self.random.set_nonce(nonce)
+        start = time.perf_counter()
+        frequency_time = self.constraints.frequency_time if self.use_constraints else 0.0
+        lo = [ max(l - 1, 0) for l in box_min ]
+        hi = [ min(h + 1, w) for h, w in zip(box_max, self.grid_size) ]
+        self.grid = WFC3DGrid([ h - l for l, h in zip(lo, hi) ], lo, self.grid_size)
+        inner = tuple(slice(l - o, h - o) for l, h, o in zip(box_min, box_max, lo))
+        halo = np.ones(self.grid.grid_size, dtype=bool)
+        halo[inner] = False
+        tiles = world[tuple(slice(l, h) for l, h in zip(lo, hi))].astype(np.int32)
+        outside = world.copy()
+        outside[region] = -1
+        tile_counts = np.bincount(outside[outside >= 0], minlength=len(self.tiles))
+        self.inner = inner
+        yield from self.solve_steps((np.flatnonzero(halo), tiles[halo]), tile_counts, self.line_offsets(world, lo, hi))
+        self.inner = None
+        self.solved_cells = self.stats.cells
+        self.world = world.copy()
+        self.world[region] = self.grid.result()[inner]
+        self.region = region
+        self.stats.solve_time = time.perf_counter() - start
+        self.stats.backtracks = self.backtracks
+        if self.use_constraints:
+            self.stats.frequency_time = self.constraints.frequency_time - frequency_time
+
+    def line_offsets(self, world, lo, hi):
+        """Returns (axis, per line tile counts) of the cells of a world outside of the grid box [lo, hi)
+        for the lines through the box (see WFC3DGrid.add_line_counts)"""
+        offsets = []
+        n = len(self.tiles)
+        for axis in range(3):
+            box = [ slice(l, h) for l, h in zip(lo, hi) ]
+            box[axis] = slice(None)
+            tiles = world[tuple(box)].astype(np.int32)
+            box = [ slice(None) ] * 3
+            box[axis] = slice(lo[axis], hi[axis])
+            tiles[tuple(box)] = -1
+            tiles = np.moveaxis(tiles, axis, -1)
+            counts = np.zeros((*tiles.shape[:2], n + 1), dtype=np.int64)
+            a, b, _ = np.nonzero(tiles >= 0)
+            np.add.at(counts, (a, b, tiles[tiles >= 0]), 1)
+            # last column: non-empty cells
+            np.add.at(counts, (a, b, n), 1)
+            offsets.append((axis, counts))
+        return offsets
+
+    def solve_steps(self, fixed=None, tile_counts=None, line_offsets=None):
+        """Solves the grid, yields after each observe/propagate step (fixed, tile_counts, line_offsets:
+        halo cells, placed tiles and (axis, per line counts) of the solved cells outside of a chunk)"""
+        self.decisions = []
+        self.backtrack_budget = self.backtracks + self.max_backtracks
+        stats = self.stats
+        start = time.perf_counter()
+        if not self.use_constraints:
+            self.grid.initialize_grid(self.tiles, None)
+            if fixed is not None:
+                self.grid.fix_cells(*fixed)
+        else:
+            self.constraints.initialize_grid(self.grid, self.propagation_mode, fixed, tile_counts)
+            self.grid.contradiction = False
+            for axis, counts in line_offsets or []:
+                self.grid.add_line_counts(axis, counts)
+            if self.use_backtracking:
+                self.grid.enable_trail()
+        if self.use_constraints and self.entropy_mode == 'SHANNON':
+            self.grid.enable_weights(self.constraints.model.tile_weights())
+            entropies = self.grid.entropies()
+        else:
+            entropies = self.grid.counts()
+        # the index starts from the initialized domains
+        self.grid.pop_changed()
+        self.entropy_index = WFC3DEntropyIndex(self.grid, self.get_entropy, entropies, self.random if self.random_start_cell else None)
+        stats.initialize_time += time.perf_counter() - start
+        if not self.use_constraints:
+            stats.peak_domain_bytes = max(stats.peak_domain_bytes, self.grid.domains.nbytes)
+        yield
+
+        while True:
+            start = time.perf_counter()
+            cell = self.get_lowest_entropy_cell()
+            if cell is None:
+                break
+            x, y, z = cell
+            if self.grid.trail is not None:
+                self.grid.push_level()
+            self.collapse(x, y, z)
+            if self.grid.trail is not None:
+                self.decisions.append((cell, self.grid.tile(x, y, z)))
+            stats.observes += 1
+            observed = time.perf_counter()
+            stats.observe_time += observed - start
+            if self.use_constraints:
+                self.constraints.propagate(self.grid, x, y, z)
+                stats.propagate_time += time.perf_counter() - observed
+                if self.grid.contradiction:
+                    stats.contradictions += 1
+                    self.backtrack()
+            yield
+        if self.use_constraints:
+            stats.add_propagator(self.constraints.propagator)
+
+    def close(self):
+        """Releases the stream store of the world (removes its temporary file), call it after
+        the results are consumed"""
+        if isinstance(self.chunks, WFC3DStreamStore):
+            self.chunks.close()
+
+    def results(self):
+        """Yields (origin, tile ids) of the solved grid or of all solved chunks"""
+        if self.region is not None:
+            yield tuple(s.start for s in self.region), self.world[self.region]
+        elif self.chunks is not None:
+            yield from self.chunks.items()
+        else:
+            yield (0, 0, 0), self.grid.result()
+
+
+def solve(ruleset, grid_size, seed=0, **options):
+    """Solves a grid for a ruleset and returns its tile ids (see WFC3DSolver for the options)"""
+    solver = WFC3DSolver(ruleset, grid_size, seed, **options)
+    try:
+        solver.run()
+        return solver.result()
+    finally:
+        solver.close()
@@ -0,0 +1,57 @@
+# runtime metrics of the last generation (shown in the generate panel)
+last = None
+
+# names of the direction families of WFC3DStats.removals (NEIGHBOR_FAMILIES order)
+FAMILY_NAMES = [ 'face', 'corner', 'edge' ]
+
+class WFC3DStats:
+    """Runtime metrics of a generation (times in seconds).
+
+    removals counts the tiles removed by the propagator per direction family, queue_pops the
+    cells (AC-4) or frontier cells (batch waves) taken from the propagation queue and
+    peak_domain_bytes the largest domain and propagator state of a grid or chunk.
+    """
+    def __init__(self):
+        self.cells = 0
+        self.chunks = 0
+        self.observes = 0
+        self.queue_pops = 0
+        self.removals = [ 0 ] * len(FAMILY_NAMES)
+        self.contradictions = 0
+        self.backtracks = 0
+        self.peak_domain_bytes = 0
+        self.placed = 0
+        self.reused = 0
+        self.initialize_time = 0.0
+        self.observe_time = 0.0
+        self.propagate_time = 0.0
+        self.frequency_time = 0.0
+        self.solve_time = 0.0
+        self.placement_time = 0.0
+
+    def add_propagator(self, propagator):
+        """Adds the counters of the propagator of a solved grid or chunk"""
+        self.queue_pops += propagator.pops
+        self.removals = [ a + int(b) for a, b in zip(self.removals, propagator.removals) ]
+        self.peak_domain_bytes = max(self.peak_domain_bytes, propagator.grid.domains.nbytes + propagator.nbytes())
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def lines(self):
+        """Returns (label, value) pairs for the user interface"""
+        return [
+            ("Cells", f"{self.cells}" + (f" ({self.chunks} chunks)" if self.chunks else "")),
+            ("Observe steps", f"{self.observes}"),
+            ("Queue pops", f"{self.queue_pops}"),
+            *((f"Removals ({name})", f"{n}") for name, n in zip(FAMILY_NAMES, self.removals)),
+            ("Contradictions", f"{self.contradictions}"),
+            ("Backtracks", f"{self.backtracks}"),
+            ("Peak domain memory", f"{self.peak_domain_bytes / 2**20:.1f} MiB" if self.peak_domain_bytes >= 2**20 else f"{self.peak_domain_bytes / 2**10:.1f} KiB"),
+            ("Initialize", f"{self.initialize_time:.3f} s"),
+            ("Observe", f"{self.observe_time:.3f} s"),
+            ("Propagate", f"{self.propagate_time:.3f} s"),
+            ("Frequency constraints", f"{self.frequency_time:.3f} s"),
+            ("Solve", f"{self.solve_time:.3f} s"),
+            ("Placement", f"{self.placement_time:.3f} s ({self.placed} objects" + (f", {self.reused} reused)" if self.reused else ")")),
+        ]
@@ -0,0 +1,180 @@
+"""Regression tests of the solver core (run without Blender).
+
+    python test_solver.py
+
+The add-on directory is loaded as package like benchmark.py does, so only NumPy is needed.
+"""
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark import _core, synthetic_ruleset
+
+solver_module = _core("solver")
+grid_module = _core("grid")
+constants = _core("constants")
+
+def violations(tiles, compat):
+    """Number of pairs of non-empty neighbor cells whose tiles do not permit each other"""
+    table = grid_module.neighbor_table(tiles.shape)
+    flat = tiles.reshape(-1)
+    count = 0
+    for k in range(len(constants.DIRECTIONS)):
+        neighbors = table[:, k]
+        pairs = (neighbors >= 0) & (flat >= 0)
+        pairs[pairs] &= flat[neighbors[pairs]] >= 0
+        count += int(np.count_nonzero(~compat[k][flat[pairs], flat[neighbors[pairs]]]))
+    return count
+
+def coloring_ruleset(n_tiles):
+    """A tile forbids itself in all 26 directions: greedy solves run into contradictions"""
+    names = [ f"tile_{i}" for i in range(n_tiles) ]
+    return { a: { d: [ b for b in names if b != a ] for d in constants.DIRECTIONS } for a in names }
+
+def per_cell_rule(grid, constraint, pos):
+    """The grid and region constraint check of a single cell before the label volumes (reference)"""
+    x, y, z = pos
+    l, w, h = grid.grid_size
+    corner = x in {0, l-1} and y in {0, w-1} and z in {0, h-1}
+    edge = not corner and sum((x in {0, l-1}, y in {0, w-1}, z in {0, h-1})) >= 2
+    inside = 0 < x < l-1 and 0 < y < w-1 and 0 < z < h-1
+    if 'corners' in constraint and corner:
+        for c in constraint['corners']:
+            if c == '' and len(constraint['corners']) == 1:
+                return True
+            if c in ('-', 'None', 'False'):
+                return False
+            if c in grid.corners and pos == grid.corners[c]:
+                return True
+        return False
+    if 'edges' in constraint and edge:
+        for c in constraint['edges']:
+            if c == '' and len(constraint['edges']) == 1:
+                return True
+            if c in ('-', 'None'):
+                return False
+            if c in grid.edges:
+                a, b = grid.edges[c]
+                if all(p == q for p, q, r in zip(pos, a, b) if q == r):
+                    return True
+        return False
+    if 'inside' in constraint and inside:
+        return False
+    if 'faces' in constraint and not corner and not edge and not inside:
+        faces = { 'top': z == h-1, 'bottom': z == 0, 'left': x == 0, 'right': x == l-1, 'front': y == 0, 'back': y == w-1 }
+        for f in constraint['faces']:
+            if f == '' and len(constraint['faces']) == 1:
+                return True
+            if f in ('-', 'None', 'False'):
+                return False
+            if faces.get(f, False):
+                return True
+        return False
+    if 'region_min' in constraint or 'region_max' in constraint:
+        rmin, rmax = constraint.get('region_min'), constraint.get('region_max')
+        lo = [ 0 if rmin is None or v < 0 else v for v in (rmin or (0, 0, 0)) ]
+        hi = [ s - 1 if rmax is None or v < 0 else v for v, s in zip(rmax or (-1, -1, -1), grid.grid_size) ]
+        return all(a <= p <= b for a, p, b in zip(lo, pos, hi))
+    return True
+
+
+class WFC3DSolverTest(unittest.TestCase):
+    def test_no_adjacency_violations(self):
+        for mode in ('AC4', 'BATCH'):
+            for mix in ('plain', 'mixed'):
+                for seed in range(2):
+                    with self.subTest(mode=mode, mix=mix, seed=seed):
+                        ruleset = synthetic_ruleset(8, 0.5, mix, (8, 8, 8), seed)
+                        solver = solver_module.WFC3DSolver(ruleset, (8, 8, 8), seed, propagation_mode=mode)
+                        solver.run()
+                        self.assertEqual(violations(solver.result(), solver.constraints.model.compat), 0)
+
+    def test_no_adjacency_violations_across_chunks(self):
+        ruleset = synthetic_ruleset(8, 0.5, 'plain', (20, 8, 6), 0)
+        for options in ({ 'use_chunks': True, 'chunk_size': (6, 6, 6) }, { 'use_streaming': True, 'stream_window': 4 }):
+            with self.subTest(**options):
+                solver = solver_module.WFC3DSolver(ruleset, (20, 8, 6), 1, **options)
+                solver.run()
+                tiles = solver.result()
+                solver.close()
+                self.assertEqual(violations(tiles, solver.constraints.model.compat), 0)
+                self.assertTrue((tiles >= -1).all())
+
+    def test_backtracking_removes_contradictions(self):
+        ruleset = coloring_ruleset(8)
+        for seed in (1, 2):
+            with self.subTest(seed=seed):
+                plain = solver_module.WFC3DSolver(ruleset, (6, 6, 6), seed)
+                stats = plain.run()
+                self.assertGreater(stats.contradictions, 0)
+                self.assertTrue((plain.result() == -1).any())
+                solver = solver_module.WFC3DSolver(ruleset, (6, 6, 6), seed, use_backtracking=True, max_backtracks=2000)
+                stats = solver.run()
+                self.assertGreater(stats.backtracks, 0)
+                tiles = solver.result()
+                self.assertFalse((tiles == -1).any())
+                self.assertEqual(violations(tiles, solver.constraints.model.compat), 0)
+
+    def test_grid_masks_match_per_cell_rule(self):
+        constraints = [ { 'corners': ['-'] }, { 'corners': ['fbl', 'btr'] }, { 'corners': [''] }, { 'edges': ['-'] },
+                        { 'edges': ['fb', 'bt', 'lt'] }, { 'faces': ['top', 'bottom'] }, { 'faces': ['None'] },
+                        { 'inside': ['False'] }, { 'inside': ['True'] }, { 'region_min': (1, 0, 1), 'region_max': (-1, 2, 3) },
+                        { 'corners': ['-'], 'edges': ['-'], 'faces': ['left'], 'inside': ['-'], 'region_max': (2, -1, -1) } ]
+        for world_size in ((5, 4, 3), (6, 6, 6), (3, 3, 3), (7, 3, 4)):
+            world = grid_module.WFC3DGrid(world_size)
+            # a box of the world (as solved by a chunk) gets its part of the world mask
+            origin = (1, 1, 0)
+            shape = tuple(w - o - 1 for w, o in zip(world_size, origin))
+            box = grid_module.WFC3DGrid(shape, origin, world_size)
+            for constraint in constraints:
+                with self.subTest(world_size=world_size, constraint=constraint):
+                    expected = np.zeros(world_size, dtype=bool)
+                    for pos in np.ndindex(*world_size):
+                        expected[pos] = per_cell_rule(world, constraint, pos)
+                    np.testing.assert_array_equal(world.grid_constraint_mask(constraint), expected)
+                    np.testing.assert_array_equal(box.grid_constraint_mask(constraint),
+                                                  expected[tuple(slice(o, o + s) for o, s in zip(origin, shape))])
+
+    def test_same_seed_same_result(self):
+        ruleset = synthetic_ruleset(8, 0.6, 'mixed', (12, 8, 6), 0)
+        for options in ({}, { 'entropy_mode': 'SHANNON', 'random_start_cell': True }, { 'use_backtracking': True },
+                        { 'use_chunks': True, 'chunk_size': (6, 6, 6) }, { 'use_streaming': True, 'stream_window': 3 }):
+            with self.subTest(**options):
+                first = solver_module.solve(ruleset, (12, 8, 6), 5, **options)
+                second = solver_module.solve(ruleset, (12, 8, 6), 5, **options)
+                np.testing.assert_array_equal(first, second)
+                self.assertEqual(first.dtype, np.int64)
+                self.assertFalse((first == solver_module.solve(ruleset, (12, 8, 6), 6, **options)).all())
+
+    def test_symmetry_refers_to_the_world(self):
+        world = grid_module.WFC3DGrid((9, 6, 4))
+        box = grid_module.WFC3DGrid((7, 6, 4), (2, 0, 0), (9, 6, 4))
+        for cell in ((3, 1, 2), (4, 0, 0), (5, 5, 3)):
+            local = tuple(c - o for c, o in zip(cell, box.origin))
+            expected = { world.coords(i) for i in world.symmetry_members(*cell, (True, False, True)).tolist() }
+            expected = { tuple(c - o for c, o in zip(m, box.origin)) for m in expected if m[0] >= box.origin[0] }
+            self.assertEqual({ box.coords(i) for i in box.symmetry_members(*local, (True, False, True)).tolist() }, expected)
+
+    def test_region_nonce_draws_new_tiles(self):
+        ruleset = synthetic_ruleset(8, 0.6, 'plain', (10, 10, 6), 0)
+        solver = solver_module.WFC3DSolver(ruleset, (10, 10, 6), 3)
+        solver.run()
+        world = solver.result().copy()
+        results = []
+        for nonce in (1, 1, 2):
+            for _ in solver.region_steps(world, (2, 2, 1), (8, 8, 5), nonce):
+                pass
+            results.append(solver.result().copy())
+        np.testing.assert_array_equal(results[0], results[1])
+        self.assertFalse((results[1] == results[2]).all())
+        outside = np.ones(world.shape, dtype=bool)
+        outside[2:8, 2:8, 1:5] = False
+        for tiles in results:
+            np.testing.assert_array_equal(tiles[outside], world[outside])
+            self.assertEqual(violations(tiles, solver.constraints.model.compat), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
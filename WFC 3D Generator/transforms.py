@@ -0,0 +1,105 @@
+import numpy as np
+
+from .rng import TRANSFORM
+
+# channels of the transformation constraints: (group, constraint prefix, component)
+CHANNELS = [ ('translation', 'translation', i) for i in range(3) ] + [ ('rotation', 'rotation', i) for i in range(3) ] \
+         + [ ('scale', 'scale', i) for i in range(3) ] + [ ('scale_uni', 'scale_uni', None) ]
+
+def step_table(vmin, vmax, steps):
+    """Returns (start, step, count, extra) of the values of a constraint component: start + k * step
+    for k < count and vmax as extra value. count == 0 is a continuous range from start to start + step"""
+    if steps < 0 and vmin > vmax:
+        steps = -steps
+        vmin, vmax = vmax, vmin
+    if steps > 0 and vmax - vmin >= 0:
+        count = int(np.floor((vmax - vmin) / steps + 1e-9)) + 1
+        extra = vmin + (count - 1) * steps < vmax - 1e-9 * max(1.0, abs(vmax))
+        return vmin, steps, count, extra
+    return vmin, vmax - vmin, 0, False
+
+def axis_rotations(axis, angles):
+    """Returns (N, 3, 3) rotation matrices around axis 0, 1 or 2"""
+    c, s = np.cos(angles), np.sin(angles)
+    m = np.zeros((len(angles), 3, 3))
+    i, j = [ (1, 2), (2, 0), (0, 1) ][axis]
+    m[:, axis, axis] = 1
+    m[:, i, i] = c
+    m[:, j, j] = c
+    m[:, i, j] = -s
+    m[:, j, i] = s
+    return m
+
+def euler_matrices(eulers):
+    """Rotation matrices of XYZ euler angles (N, 3): Rz @ Ry @ Rx"""
+    eulers = np.asarray(eulers, dtype=float)
+    return axis_rotations(2, eulers[:, 2]) @ axis_rotations(1, eulers[:, 1]) @ axis_rotations(0, eulers[:, 0])
+
+def matrix_eulers(rotations):
+    """XYZ euler angles (N, 3) of rotation matrices (N, 3, 3)"""
+    r = rotations
+    cy = np.hypot(r[:, 0, 0], r[:, 1, 0])
+    regular = cy > 1e-6
+    x = np.where(regular, np.arctan2(r[:, 2, 1], r[:, 2, 2]), np.arctan2(-r[:, 1, 2], r[:, 1, 1]))
+    y = np.arctan2(-r[:, 2, 0], cy)
+    z = np.where(regular, np.arctan2(r[:, 1, 0], r[:, 0, 0]), 0.0)
+    return np.stack([ x, y, z ], axis=1)
+
+
+class WFC3DTransformSampler:
+    """Samples the transformation constraints of many cells at once.
+
+    The step table (see step_table) of each tile and channel is built once, a cell draws a
+    uniform number per channel (keyed by its world index, see WFC3DRandom) that picks a step or
+    a value of the continuous range. The rotation rotates around the local X, Y and Z axes in
+    this order (R0 @ Rx @ Ry @ Rz), scale constraints replace the scale.
+    """
+    def __init__(self, model):
+        n = len(model.tiles)
+        self.tables = np.zeros((len(CHANNELS), n, 2))
+        self.counts = np.zeros((len(CHANNELS), n), dtype=np.int64)
+        self.extra = np.zeros((len(CHANNELS), n), dtype=bool)
+        self.vmax = np.zeros((len(CHANNELS), n))
+        for c, (group, prefix, i) in enumerate(CHANNELS):
+            if prefix == 'scale_uni':
+                vmin, vmax, steps = (model.scale_uni[:, k] for k in range(3))
+            else:
+                vmin, vmax, steps = (getattr(model, f"{prefix}_{name}")[:, i] for name in ('min', 'max', 'steps'))
+            for tile in range(n):
+                start, step, count, extra = step_table(float(vmin[tile]), float(vmax[tile]), float(steps[tile]))
+                self.tables[c, tile] = start, step
+                self.counts[c, tile] = count
+                self.extra[c, tile] = extra
+                self.vmax[c, tile] = max(vmin[tile], vmax[tile])
+        t = model.transformations
+        self.translate = t['translation'].copy()
+        self.rotate = t['rotation'].copy()
+        self.scale_uni = (model.scale_type == 1) & t['scale_uni']
+        self.scale = (model.scale_type == 2) & t['scale']
+
+    def _channel(self, c, tiles, u):
+        start, step = self.tables[c, tiles, 0], self.tables[c, tiles, 1]
+        counts = self.counts[c, tiles]
+        n = counts + self.extra[c, tiles]
+        k = np.minimum((u * n).astype(np.int64), np.maximum(n - 1, 0))
+        values = np.where(counts > 0, start + k * step, start + step * u)
+        return np.where((counts > 0) & (k >= counts), self.vmax[c, tiles], values)
+
+    def sample(self, tiles, cells, random):
+        """Returns the translation offsets, rotation angles and scales (N, 3) of cells (world indices)
+        with tile ids and a mask of the cells whose scale is set by a constraint"""
+        tiles = np.asarray(tiles, dtype=np.int64)
+        u = np.stack([ random.randoms(TRANSFORM, cells, c) for c in range(len(CHANNELS)) ]).reshape(len(CHANNELS), len(tiles))
+        values = np.stack([ self._channel(c, tiles, u[c]) for c in range(len(CHANNELS)) ])
+        offsets = np.where(self.translate[tiles, np.newaxis], values[0:3].T, 0.0)
+        angles = np.where(self.rotate[tiles, np.newaxis], values[3:6].T, 0.0)
+        scales = np.ones((len(tiles), 3))
+        uni, axes = self.scale_uni[tiles], self.scale[tiles]
+        scales[uni] = values[9, uni, np.newaxis]
+        scales[axes] = values[6:9, axes].T
+        return offsets, angles, scales, uni | axes
+
+    def rotations(self, angles, base=None):
+        """Returns the rotation matrices R0 @ Rx @ Ry @ Rz (R0: base rotations or identity)"""
+        r = axis_rotations(0, angles[:, 0]) @ axis_rotations(1, angles[:, 1]) @ axis_rotations(2, angles[:, 2])
+        return r if base is None else base @ r